@@ -0,0 +1,106 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from store.models import Customer
+from store.replicas import reading_from_primary
+
+CUSTOMER_ID_CLAIM = 'customer_id'
+IS_STAFF_CLAIM = 'is_staff'
+
+
+class UserCache:
+    """
+    A small per-process LRU of user rows with a short TTL. Entries are
+    dropped by the core signal handlers whenever a user is saved or deleted
+    or their groups or permissions change; the TTL bounds staleness from
+    anything else (another process, group permission edits).
+    """
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        # Tokens carry the id as a string, signal handlers as the pk.
+        user_id = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                # Hand out a copy so per-request state (permission caches,
+                # attributes set by views) never leaks between requests.
+                return copy.copy(entry[1])
+
+        try:
+            # A replica may not have the user yet, or still see them active.
+            with reading_from_primary():
+                user = get_user_model().objects.get(
+                    **{api_settings.USER_ID_FIELD: user_id})
+        except get_user_model().DoesNotExist:
+            # The token outlived its user.
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return copy.copy(user)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    Authenticates from the customer_id claim added by
+    core.serializers.TokenObtainPairSerializer without querying
+    store_customer. The user row comes from `user_cache`, so deleted,
+    deactivated and demoted users are turned away within its TTL.
+
+    Tokens issued before the claims existed fall back to loading the user
+    and customer from the database.
+    """
+
+    def authenticate(self, request):
+        # Writes may save request.user (djoser's user endpoints do), so
+        # they get a fresh row rather than a copy that could be up to a TTL
+        # old and undo another process's change.
+        self.fresh_user = request.method not in SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        if CUSTOMER_ID_CLAIM in validated_token and IS_STAFF_CLAIM in validated_token:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+            if getattr(self, 'fresh_user', False):
+                user_cache.invalidate(user_id)
+            user = user_cache.get(user_id)
+            if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+                raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+            user.customer_id = validated_token[CUSTOMER_ID_CLAIM]
+            return user
+
+        with reading_from_primary():
+            user = super().get_user(validated_token)
+            user.customer_id = Customer.objects \
+                .filter(user_id=user.id) \
+                .values_list('id', flat=True) \
+                .first()
+        return user
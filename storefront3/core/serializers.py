@@ -1,5 +1,11 @@
 from store.models import Customer
 from djoser.serializers import UserSerializer as BaseUserSerializer, UserCreateSerializer as BaseUserCreateSerializer
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as BaseTokenObtainPairSerializer, \
+    TokenRefreshSerializer as BaseTokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from .authentication import CUSTOMER_ID_CLAIM, IS_STAFF_CLAIM
 
 
 class UserCreateSerializer(BaseUserCreateSerializer):
@@ -10,4 +16,36 @@ class UserCreateSerializer(BaseUserCreateSerializer):
 
 class UserSerializer(BaseUserSerializer):
     class Meta(BaseUserSerializer.Meta):
-        fields = ['id', 'username', 'email', 'first_name', 'last_name']
\ No newline at end of file
+        fields = ['id', 'username', 'email', 'first_name', 'last_name']
+
+
+def add_user_claims(token, user):
+    token[IS_STAFF_CLAIM] = user.is_staff
+    token[CUSTOMER_ID_CLAIM] = Customer.objects \
+        .filter(user_id=user.id) \
+        .values_list('id', flat=True) \
+        .first()
+
+
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        # Access tokens derived from this refresh token copy its claims.
+        token = super().get_token(user)
+        add_user_claims(token, user)
+        return token
+
+
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    def validate(self, attrs):
+        # Re-reads the claims so a refreshed access token reflects the
+        # user as they are now, not as they were at login.
+        refresh = self.token_class(attrs['refresh'])
+        user = get_user_model().objects \
+            .filter(**{api_settings.USER_ID_FIELD: refresh.get(api_settings.USER_ID_CLAIM)}) \
+            .first()
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(
+                self.error_messages['no_active_account'], 'no_active_account')
+        add_user_claims(refresh, user)
+        return super().validate({**attrs, 'refresh': str(refresh)})
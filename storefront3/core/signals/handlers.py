@@ -1,6 +1,29 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from store.signals import order_created
+from core.authentication import user_cache
 
 @receiver(order_created)
 def on_order_created(sender, **kwargs):
-  print(kwargs['order'])
\ No newline at end of file
+  print(kwargs['order'])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, **kwargs):
+  user_cache.invalidate(kwargs['instance'].id)
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+@receiver(m2m_changed, sender=get_user_model().user_permissions.through)
+def invalidate_cached_user_permissions(sender, **kwargs):
+  if kwargs['reverse']:
+    # Changed from the group/permission side: pk_set holds user ids.
+    for user_id in kwargs['pk_set'] or []:
+      user_cache.invalidate(user_id)
+    if kwargs['action'] == 'pre_clear':
+      user_cache.clear()
+  else:
+    user_cache.invalidate(kwargs['instance'].id)
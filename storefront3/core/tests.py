@@ -1,3 +1,70 @@
 from django.test import TestCase
+from rest_framework.test import APIClient
+from core.authentication import user_cache
+from core.models import User
+from core.serializers import TokenObtainPairSerializer
 
-# Create your tests here.
+
+class ClaimsJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret', is_staff=True)
+        self.client = APIClient()
+
+    def authenticate(self, user):
+        token = TokenObtainPairSerializer.get_token(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+
+    def test_deleted_user_is_rejected(self):
+        self.authenticate(self.user)
+        customer_id = self.user.customer.id
+        self.user.delete()
+        response = self.client.get(f'/store/customers/{customer_id}/history/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.authenticate(self.user)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get('/store/customers/me/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_deleted_staff_user_loses_staff_access(self):
+        self.authenticate(self.user)
+        self.assertEqual(self.client.get('/store/customers/').status_code, 200)
+        self.user.delete()
+        self.assertEqual(self.client.get('/store/customers/').status_code, 401)
+
+    def test_refresh_reads_is_staff_from_the_database(self):
+        refresh = TokenObtainPairSerializer.get_token(self.user)
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.post('/auth/jwt/refresh/', {'refresh': str(refresh)})
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {response.data["access"]}')
+        self.assertEqual(self.client.get('/store/customers/').status_code, 403)
+
+    def test_refresh_is_refused_for_deactivated_user(self):
+        refresh = TokenObtainPairSerializer.get_token(self.user)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post('/auth/jwt/refresh/', {'refresh': str(refresh)})
+        self.assertEqual(response.status_code, 401)
+
+    def test_demoted_staff_user_loses_staff_access(self):
+        self.authenticate(self.user)
+        self.assertEqual(self.client.get('/store/customers/').status_code, 200)
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get('/store/customers/').status_code, 403)
+
+    def test_user_endpoints_save_the_real_user(self):
+        self.authenticate(self.user)
+        response = self.client.patch('/auth/users/me/', {'first_name': 'Alice'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/auth/users/set_password/',
+                                    {'current_password': 'secret', 'new_password': 'n3w-Passw0rd!'})
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Alice')
+        self.assertTrue(self.user.check_password('n3w-Passw0rd!'))
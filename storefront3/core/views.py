@@ -1,3 +1,16 @@
-from django.shortcuts import render
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from storefront.db.pool import pool_stats as get_pool_stats
+from store.cache import cache_stats as get_cache_stats
 
-# Create your views here.
+
+@staff_member_required
+def pool_stats(request):
+    # Counters are per worker process; scrape every worker.
+    return JsonResponse(get_pool_stats())
+
+
+@staff_member_required
+def cache_stats(request):
+    # Per worker process, like pool_stats.
+    return JsonResponse(get_cache_stats())
@@ -0,0 +1,496 @@
+import copy
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from urllib.parse import urlencode
+from django.core.cache import caches
+from django.db import connections
+from django.db.models import Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.shortcuts import get_object_or_404
+from rest_framework.response import Response
+
+
+logger = logging.getLogger(__name__)
+
+CATALOG = 'catalog'
+COLLECTIONS = 'collections'
+CUSTOMERS = 'customers'
+
+# Change markers record when rows that don't carry their own timestamp
+# (images, collections, deleted or bulk-updated products) last changed.
+PRODUCTS_MARKER = 'products'
+PRODUCT_IMAGES_MARKER = 'product_images'
+COLLECTIONS_MARKER = 'collections'
+
+
+def get_cache():
+    return caches['default']
+
+
+def reading_from_primary():
+    # store.replicas imports this module, so it can't be imported up top.
+    from .replicas import reading_from_primary
+    return reading_from_primary()
+
+
+def _version_key(namespace):
+    return f'store:{namespace}:version'
+
+
+def get_namespace_version(namespace):
+    # Seeding from the clock rather than 1 keeps an evicted version key from
+    # resurrecting entries written under an earlier version.
+    return get_cache().get_or_set(_version_key(namespace), time.time_ns, timeout=None)
+
+
+# How long a process trusts its copy of a namespace version. Bumps from this
+# process are seen at once; bumps from other processes within this delay.
+LOCAL_VERSION_TTL = 1
+
+_local_versions = {}
+
+
+def get_local_namespace_version(namespace):
+    now = time.monotonic()
+    entry = _local_versions.get(namespace)
+    if entry is None or entry[0] <= now:
+        entry = _local_versions[namespace] = (now + LOCAL_VERSION_TTL, get_namespace_version(namespace))
+    return entry[1]
+
+
+def bump_namespace(namespace):
+    """
+    Invalidates every entry in a namespace at once by moving it to a new
+    version; the old entries are never read again and simply age out.
+    """
+    _local_versions.pop(namespace, None)
+    try:
+        return get_cache().incr(_version_key(namespace))
+    except ValueError:
+        version = time.time_ns()
+        get_cache().set(_version_key(namespace), version, timeout=None)
+        return version
+
+
+def _marker_key(name):
+    return f'store:{name}:changed_at'
+
+
+def touch_marker(name):
+    get_cache().set(_marker_key(name), time.time(), timeout=None)
+
+
+def get_marker(name):
+    # A missing marker is treated as "changed now", which only ever costs a
+    # spurious 200, never a wrong 304.
+    return get_cache().get_or_set(_marker_key(name), time.time, timeout=None)
+
+
+def request_fingerprint(request):
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    # Responses embed absolute links (pagination, image urls), so the host
+    # is part of the fingerprint.
+    return hashlib.md5(
+        f'{request.get_host()}{request.path}?{query}'.encode()).hexdigest()
+
+
+def request_cache_key(namespace, request):
+    version = get_namespace_version(namespace)
+    return f'store:{namespace}:{version}:response:{request_fingerprint(request)}'
+
+
+MISSING = object()
+
+
+class LocalCache:
+    """
+    A bounded per-process LRU with a TTL per entry. Values are handed out as
+    shallow copies so per-request changes never leak between requests.
+    """
+
+    def __init__(self, max_size=1024, timeout=30):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            if entry[0] <= now:
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return copy.copy(entry[1])
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key within a process: the first
+    caller runs the function, later callers wait for and share its result
+    (or its exception) instead of running it again.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self, key):
+        return key in self._calls
+
+    def do(self, key, func):
+        """
+        Returns (result, leader), where `leader` is False for callers that
+        got another caller's result.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event()}
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call['done'].wait()
+            if 'error' in call:
+                raise call['error']
+            return call['result'], False
+
+        try:
+            call['result'] = func()
+        except BaseException as error:
+            call['error'] = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+        return call['result'], True
+
+
+class TieredCache:
+    """
+    A LocalCache (L1) in front of the shared Django cache (L2), with keys
+    versioned by a namespace so bump_namespace() invalidates both tiers.
+    Entries written under an old version are never read again, in any
+    process, once its local copy of the version expires.
+    """
+
+    def __init__(self, namespace, name, timeout=60 * 60, local_size=1024, local_timeout=30):
+        self.namespace = namespace
+        self.name = name
+        self.timeout = timeout
+        self.local = LocalCache(local_size, local_timeout)
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.flight = SingleFlight()
+        caches_by_name[name] = self
+
+    def make_key(self, key):
+        version = get_local_namespace_version(self.namespace)
+        return f'store:{self.namespace}:{version}:{self.name}:{key}'
+
+    def get(self, key, default=None):
+        full_key = self.make_key(key)
+        value = self.local.get(full_key)
+        if value is not MISSING:
+            self.local_hits += 1
+            return value
+
+        value = get_cache().get(full_key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self.shared_hits += 1
+        self.local.set(full_key, value)
+        return copy.copy(value)
+
+    def set(self, key, value, timeout=None):
+        full_key = self.make_key(key)
+        get_cache().set(full_key, value, self.timeout if timeout is None else timeout)
+        self.local.set(full_key, value)
+        self.sets += 1
+
+    def get_or_set(self, key, default, timeout=None):
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+
+        def compute():
+            value = default() if callable(default) else default
+            self.set(key, value, timeout)
+            return value
+
+        # Concurrent misses on one key share a single computation.
+        value, leader = self.flight.do(key, compute)
+        return value if leader else copy.copy(value)
+
+    def delete(self, key):
+        full_key = self.make_key(key)
+        get_cache().delete(full_key)
+        self.local.delete(full_key)
+
+    def stats(self):
+        lookups = self.local_hits + self.shared_hits + self.misses
+        return {
+            'namespace': self.namespace,
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.local_hits + self.shared_hits) / lookups, 4) if lookups else None,
+            'sets': self.sets,
+            'local_size': len(self.local),
+            'local_evictions': self.local.evictions,
+            'coalesced': self.flight.coalesced,
+        }
+
+
+caches_by_name = {}
+
+# Lookups in the catalog namespace are invalidated with the response cache
+# by every catalog write; customers by the customer signal handler.
+# Collections are served whole by StaleWhileRevalidateMixin, and ContentType
+# lookups need no entry here: ContentTypeManager already keeps them in a
+# per-process cache.
+product_cache = TieredCache(CATALOG, 'product')
+customer_cache = TieredCache(CUSTOMERS, 'customer')
+
+
+response_flight = SingleFlight()
+response_stats = Counter()
+refresh_flight = SingleFlight()
+revalidate_stats = Counter()
+
+
+def _hit_ratio(hits, total):
+    return round(hits / total, 4) if total else None
+
+
+def cache_stats():
+    stats = {name: cache.stats() for name, cache in caches_by_name.items()}
+    stats['responses'] = {**response_stats, 'coalesced': response_flight.coalesced}
+
+    hits = revalidate_stats['hits'] + revalidate_stats['stale_hits']
+    refreshes = revalidate_stats['refreshes'] + revalidate_stats['refresh_errors']
+    stats['revalidated'] = {
+        **revalidate_stats,
+        'hit_ratio': _hit_ratio(hits, hits + revalidate_stats['misses']),
+        'mean_refresh_ms': round(revalidate_stats['refresh_seconds'] / refreshes * 1000, 3) if refreshes else None,
+    }
+    return stats
+
+
+class CachedObjectMixin:
+    """
+    Serves the object of a plain retrieve from `object_cache`; writes and
+    filtered lookups always read the database.
+    """
+    object_cache = None
+
+    def get_object(self):
+        if self.action != 'retrieve' or self.request.query_params:
+            return super().get_object()
+
+        def load():
+            with reading_from_primary():
+                return super(CachedObjectMixin, self).get_object()
+
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        obj = self.object_cache.get_or_set(lookup, load)
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+
+class CachedResponseMixin:
+    """
+    Caches the serialized data of anonymous list and retrieve responses in a
+    versioned namespace that model signals bump on every write.
+    """
+    cache_namespace = CATALOG
+    cache_timeout = 60 * 60 * 24
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        if request.user and request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        key = request_cache_key(self.cache_namespace, request)
+        data = get_cache().get(key)
+        if data is not None:
+            response_stats['hits'] += 1
+            return Response(data)
+
+        # The last good copy outlives namespace bumps, so while one request
+        # rebuilds an entry the others can be answered from it.
+        stale_key = f'store:{self.cache_namespace}:stale:response:{request_fingerprint(request)}'
+        if response_flight.in_flight(key):
+            data = get_cache().get(stale_key)
+            if data is not None:
+                response_stats['stale'] += 1
+                return Response(data)
+
+        def build():
+            with reading_from_primary():
+                response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                get_cache().set_many({key: response.data, stale_key: response.data}, self.cache_timeout)
+            return response
+
+        response_stats['misses'] += 1
+        response, leader = response_flight.do(key, build)
+        if leader:
+            return response
+        if response.status_code == 200:
+            return Response(response.data)
+        return view(request, *args, **kwargs)
+
+
+class StaleWhileRevalidateMixin:
+    """
+    Caches list and retrieve responses of an unpaginated viewset for every
+    user. Past `cache_soft_timeout` an entry is still served while a
+    background thread rebuilds it; writes bump `cache_namespace`, which
+    drops every entry at once.
+    """
+    cache_namespace = COLLECTIONS
+    cache_soft_timeout = 60
+    cache_timeout = 60 * 60 * 24
+
+    def list(self, request, *args, **kwargs):
+        return self.revalidating_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.revalidating_response(super().retrieve, request, *args, **kwargs)
+
+    def revalidating_response(self, view, request, *args, **kwargs):
+        key = request_cache_key(self.cache_namespace, request)
+        entry = get_cache().get(key)
+        if entry is None:
+            revalidate_stats['misses'] += 1
+            with reading_from_primary():
+                response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                self.store_entry(key, response.data)
+            return response
+
+        if entry['fresh_until'] > time.time():
+            revalidate_stats['hits'] += 1
+        else:
+            revalidate_stats['stale_hits'] += 1
+            if not refresh_flight.in_flight(key):
+                threading.Thread(target=self.refresh_entry, args=(key,), daemon=True).start()
+        return Response(entry['data'])
+
+    def store_entry(self, key, data):
+        entry = {'data': data, 'fresh_until': time.time() + self.cache_soft_timeout}
+        get_cache().set(key, entry, self.cache_timeout)
+
+    def build_data(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'list':
+            return self.get_serializer(queryset, many=True).data
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        instance = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return self.get_serializer(instance).data
+
+    def refresh_entry(self, key):
+        started = time.perf_counter()
+        try:
+            refresh_flight.do(key, lambda: self.store_entry(key, self.build_data()))
+            revalidate_stats['refreshes'] += 1
+        except Exception:
+            revalidate_stats['refresh_errors'] += 1
+            logger.exception('Refreshing %s failed', key)
+        finally:
+            revalidate_stats['refresh_seconds'] += time.perf_counter() - started
+            # This thread's connections would otherwise never be closed.
+            connections.close_all()
+
+
+class ConditionalGetMixin:
+    """
+    Answers If-None-Match / If-Modified-Since on list and retrieve with a 304
+    before any serialization happens. The validators are per table, not per
+    page: any catalog write changes every ETag, which costs some spurious
+    200s but only one indexed query per request.
+    """
+    last_modified_field = 'last_update'
+    change_markers = [PRODUCTS_MARKER, PRODUCT_IMAGES_MARKER, COLLECTIONS_MARKER]
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_validators(self, request):
+        # Every write through the ORM touches a marker; the unfiltered MAX
+        # is answered from the index on last_modified_field and also
+        # catches rows changed behind the ORM's back.
+        markers = [get_marker(name) for name in self.change_markers]
+        last_modified = self.get_queryset().model._default_manager \
+            .aggregate(value=Max(self.last_modified_field))['value']
+        timestamps = markers[:]
+        if last_modified is not None:
+            timestamps.append(last_modified.timestamp())
+
+        parts = [request_fingerprint(request), last_modified, *markers]
+        etag = hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+        # Last-Modified has whole-second precision: while the newest change
+        # is under a second old, a later write in the same second would go
+        # unnoticed by If-Modified-Since, so only the ETag is offered.
+        newest = max(timestamps)
+        if time.time() - newest < 1:
+            return quote_etag(etag), None
+        return quote_etag(etag), int(newest)
+
+    def conditional_response(self, view, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
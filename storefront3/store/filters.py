@@ -1,5 +1,7 @@
 from django_filters.rest_framework import FilterSet
+from rest_framework.filters import OrderingFilter, SearchFilter
 from .models import Product
+from .search import get_search_backend
 
 class ProductFilter(FilterSet):
   class Meta:
@@ -7,4 +9,28 @@ class ProductFilter(FilterSet):
     fields = {
       'collection_id': ['exact'],
       'unit_price': ['gt', 'lt']
-    }
\ No newline at end of file
+    }
+
+
+class ProductSearchFilter(SearchFilter):
+  """
+  Hands ?search= to the configured search backend instead of OR-ing
+  LIKE '%term%' over every search field.
+  """
+  def filter_queryset(self, request, queryset, view):
+    terms = self.get_search_terms(request)
+    if not terms:
+      return queryset
+    return get_search_backend().search(queryset, ' '.join(terms))
+
+
+class RelevanceOrderingFilter(OrderingFilter):
+  """
+  Orders search results by relevance unless the client asked for an
+  explicit ?ordering=.
+  """
+  def get_ordering(self, request, queryset, view):
+    if request.query_params.get(self.ordering_param) is None \
+        and 'search_rank' in queryset.query.annotations:
+      return ['-search_rank']
+    return super().get_ordering(request, queryset, view)
@@ -0,0 +1,80 @@
+import traceback
+from datetime import timedelta
+from django.db.models import Q
+from django.utils import timezone
+from .models import Job, Order
+from .signals import order_created
+
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(seconds=10)
+# A running job whose worker died is handed out again after this long.
+LEASE = timedelta(minutes=5)
+
+handlers = {}
+
+
+def handler(name):
+    def register(func):
+        handlers[name] = func
+        return func
+    return register
+
+
+@handler('order_created')
+def send_order_created(order_id):
+    from .serializers import CreateOrderSerializer
+
+    order = Order.objects.get(pk=order_id)
+    for receiver, response in order_created.send_robust(CreateOrderSerializer, order=order):
+        if isinstance(response, Exception):
+            # Retrying re-runs every receiver, so receivers must tolerate
+            # seeing the same order more than once.
+            raise response
+
+
+def _runnable(now):
+    return Q(status=Job.STATUS_PENDING, run_at__lte=now) \
+        | Q(status=Job.STATUS_RUNNING, locked_at__lt=now - LEASE)
+
+
+def claim_jobs(limit):
+    """
+    Claims up to `limit` due jobs. Each claim is a conditional UPDATE, so
+    concurrent workers never run the same job twice, on any database.
+    """
+    now = timezone.now()
+    candidates = Job.objects \
+        .filter(_runnable(now)) \
+        .order_by('run_at') \
+        .values_list('id', flat=True)[:limit]
+
+    claimed = []
+    for job_id in candidates:
+        updated = Job.objects \
+            .filter(_runnable(now), pk=job_id) \
+            .update(status=Job.STATUS_RUNNING, locked_at=now)
+        if updated:
+            claimed.append(job_id)
+    return Job.objects.filter(pk__in=claimed)
+
+
+def run_job(job):
+    try:
+        handlers[job.name](**job.payload)
+    except Exception:
+        job.attempts += 1
+        job.last_error = traceback.format_exc()
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = Job.STATUS_FAILED
+        else:
+            job.status = Job.STATUS_PENDING
+            job.run_at = timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)
+        job.locked_at = None
+        job.save(update_fields=['attempts', 'last_error', 'status', 'run_at', 'locked_at'])
+        return False
+
+    job.status = Job.STATUS_DONE
+    job.locked_at = None
+    job.save(update_fields=['status', 'locked_at'])
+    return True
@@ -0,0 +1,192 @@
+import json
+import math
+import random
+import statistics
+import time
+from datetime import datetime
+from decimal import Decimal
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+from core.models import User
+from core.serializers import TokenObtainPairSerializer
+from store.models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, Review
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    rank = max(math.ceil(percent / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks every store endpoint in-process against a freshly seeded test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collections', type=int, default=10)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--customers', type=int, default=50)
+        parser.add_argument('--orders', type=int, default=500)
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--output', default='benchmark.json',
+                            help='Where to write the JSON results')
+        parser.add_argument('--compare',
+                            help='A previous JSON result to print deltas against')
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            print('Seeding the benchmark database...')
+            self.seed(options)
+            results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'created_at': datetime.now().isoformat(),
+            'vendor': connection.vendor,
+            'options': {key: options[key] for key in
+                        ['collections', 'products', 'customers', 'orders', 'iterations']},
+            'endpoints': results,
+        }
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, indent=2)
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)['endpoints']
+        self.print_report(results, baseline)
+        print(f"Results written to {options['output']}")
+
+    def seed(self, options):
+        rng = random.Random(0)
+        collections = Collection.objects.bulk_create([
+            Collection(title=f'Collection {i}') for i in range(options['collections'])])
+        products = Product.objects.bulk_create([
+            Product(
+                title=f'Product {i}',
+                slug=f'product-{i}',
+                description=f'Description of product {i} ' * 5,
+                unit_price=Decimal(rng.randint(100, 99999)) / 100,
+                inventory=10 ** 6,
+                collection=rng.choice(collections))
+            for i in range(options['products'])])
+        Review.objects.bulk_create([
+            Review(product=products[0], name=f'Reviewer {i}', description='Good')
+            for i in range(20)])
+
+        users = User.objects.bulk_create([
+            User(username=f'user{i}', email=f'user{i}@example.com', password='!')
+            for i in range(options['customers'])])
+        users[0].is_staff = True
+        users[0].save()
+        # bulk_create skips the signal that creates a customer per user.
+        customers = Customer.objects.bulk_create([Customer(user=user) for user in users])
+
+        orders = Order.objects.bulk_create([
+            Order(customer=rng.choice(customers)) for _ in range(options['orders'])])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=rng.randint(1, 5),
+                      unit_price=product.unit_price)
+            for order in orders
+            for product in rng.sample(products, rng.randint(1, 5))])
+
+        self.products = products
+        self.customer = Customer.objects.exclude(user__is_staff=True).first()
+        self.staff = users[0]
+
+    def make_cart(self, size=5):
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=1)
+            for product in self.products[:size]])
+        return cart
+
+    def client_for(self, user):
+        client = APIClient()
+        if user is not None:
+            token = TokenObtainPairSerializer.get_token(user).access_token
+            client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+        return client
+
+    def endpoints(self):
+        """
+        One entry per route in store/urls.py:
+        (name, client, method, url, request body factory).
+        """
+        anonymous = self.client_for(None)
+        customer = self.client_for(self.customer.user)
+        staff = self.client_for(self.staff)
+        product = self.products[0]
+        cart = self.make_cart()
+        order = Order.objects.filter(customer=self.customer).first() or Order.objects.first()
+
+        return [
+            ('products-list', anonymous, 'get', '/store/products/', None),
+            ('products-list-auth', customer, 'get', '/store/products/', None),
+            ('products-search', customer, 'get', '/store/products/?search=product', None),
+            ('products-list-sparse', customer, 'get', '/store/products/?fields=id,title,unit_price', None),
+            ('products-list-expanded', customer, 'get', '/store/products/?expand=collection,promotions', None),
+            ('products-detail', customer, 'get', f'/store/products/{product.id}/', None),
+            ('product-reviews-list', customer, 'get', f'/store/products/{product.id}/reviews/', None),
+            ('product-images-list', customer, 'get', f'/store/products/{product.id}/images/', None),
+            ('collections-list', customer, 'get', '/store/collections/', None),
+            ('collections-detail', customer, 'get', f'/store/collections/{product.collection_id}/', None),
+            ('carts-create', anonymous, 'post', '/store/carts/', None),
+            ('carts-detail', anonymous, 'get', f'/store/carts/{cart.id}/', None),
+            ('cart-items-list', anonymous, 'get', f'/store/carts/{cart.id}/items/', None),
+            ('cart-items-create', anonymous, 'post', f'/store/carts/{cart.id}/items/',
+             lambda: {'product_id': product.id, 'quantity': 1}),
+            ('customers-list', staff, 'get', '/store/customers/', None),
+            ('customers-me', customer, 'get', '/store/customers/me/', None),
+            ('orders-list', customer, 'get', '/store/orders/', None),
+            ('orders-list-staff', staff, 'get', '/store/orders/', None),
+            ('orders-detail', staff, 'get', f'/store/orders/{order.id}/', None),
+            ('orders-create', customer, 'post', '/store/orders/',
+             lambda: {'cart_id': str(self.make_cart().id)}),
+        ]
+
+    def run(self, options):
+        results = {}
+        for name, client, method, url, body in self.endpoints():
+            caches['default'].clear()
+            timings, queries, sizes, statuses = [], [], [], set()
+            for _ in range(options['iterations']):
+                data = body() if body else None
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    response = getattr(client, method)(url, data, format='json')
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries.append(len(context))
+                sizes.append(len(response.content))
+                statuses.add(response.status_code)
+
+            results[name] = {
+                'method': method.upper(),
+                'url': url,
+                'status': sorted(statuses),
+                'p50_ms': round(percentile(timings, 50), 3),
+                'p95_ms': round(percentile(timings, 95), 3),
+                'p99_ms': round(percentile(timings, 99), 3),
+                'mean_ms': round(statistics.mean(timings), 3),
+                'queries': round(statistics.mean(queries), 2),
+                'bytes': round(statistics.mean(sizes)),
+            }
+        return results
+
+    def print_report(self, results, baseline=None):
+        print(f"{'endpoint':<22}{'status':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'bytes':>9}")
+        for name, row in results.items():
+            line = (f"{name:<22}{','.join(map(str, row['status'])):>10}"
+                    f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+                    f"{row['queries']:>9g}{row['bytes']:>9}")
+            if baseline and name in baseline:
+                before = baseline[name]
+                change = (row['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+                line += f"  p50 {change:+.1f}%, queries {row['queries'] - before['queries']:+g}"
+            print(line)
@@ -0,0 +1,114 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from store.models import Collection, Product, ProductImage
+from store.serializers import ProductSerializer, ProductValuesSerializer
+from store.views import ProductViewSet
+
+
+class Command(BaseCommand):
+    help = 'Compares ProductSerializer with the values() fast path: identical output, CPU time per list'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--rows', type=int, default=500,
+                            help='Rows serialized per iteration in the serializer comparison')
+        parser.add_argument('--iterations', type=int, default=30)
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.seed(options['products'])
+            self.check_identical()
+            self.compare_serializers(options['rows'], options['iterations'])
+            self.compare_endpoint(options['iterations'])
+        finally:
+            ProductViewSet.values_serializer_class = ProductValuesSerializer
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def seed(self, count):
+        rng = random.Random(0)
+        collections = Collection.objects.bulk_create([Collection(title=f'Collection {i}') for i in range(10)])
+        products = Product.objects.bulk_create([
+            Product(
+                title=f'Product {i}',
+                slug=f'product-{i}',
+                description=f'Description of product {i} ' * 5 if i % 7 else None,
+                unit_price=Decimal(rng.randint(100, 99999)) / 100,
+                inventory=rng.randint(0, 100),
+                collection=rng.choice(collections))
+            for i in range(count)])
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image=f'store/images/product-{product.id}-{n}.png')
+            for product in products
+            for n in range(rng.randint(0, 2))])
+
+    def get(self, url, fast):
+        ProductViewSet.values_serializer_class = ProductValuesSerializer if fast else None
+        caches['default'].clear()
+        return APIClient().get(url)
+
+    def check_identical(self):
+        urls = [
+            '/store/products/',
+            '/store/products/?ordering=-unit_price',
+            '/store/products/?ordering=last_update',
+            '/store/products/?fields=id,title,unit_price',
+            '/store/products/?fields=price_with_tax,images',
+            '/store/products/?search=product',
+            '/store/products/?collection_id=1&unit_price__gt=100',
+        ]
+        next_page = self.get(urls[0], fast=False).json()['next']
+        urls.append(next_page.replace('http://testserver', ''))
+
+        for url in urls:
+            regular, fast = self.get(url, fast=False), self.get(url, fast=True)
+            if regular.status_code != 200 or regular.content != fast.content:
+                raise CommandError(f'Output differs for {url}')
+        print(f'Identical output on {len(urls)} list URLs.')
+
+    def measure(self, func, iterations):
+        samples = []
+        for _ in range(iterations):
+            start = time.process_time()
+            func()
+            samples.append((time.process_time() - start) * 1000)
+        return statistics.median(samples)
+
+    def compare_serializers(self, rows, iterations):
+        request = RequestFactory().get('/store/products/')
+        context = {'request': request}
+        queryset = Product.objects.order_by('id')[:rows]
+        renderer = JSONRenderer()
+
+        def regular():
+            products = queryset.prefetch_related('images')
+            return renderer.render(ProductSerializer(products, many=True, context=context).data)
+
+        def fast():
+            serializer = ProductValuesSerializer(context=context)
+            return renderer.render(serializer.to_representation(list(serializer.get_rows(queryset))))
+
+        if regular() != fast():
+            raise CommandError('Serializer output differs')
+        self.report(f'{rows} rows', self.measure(regular, iterations), self.measure(fast, iterations))
+
+    def compare_endpoint(self, iterations):
+        url = '/store/products/'
+        regular = self.measure(lambda: self.get(url, fast=False), iterations)
+        fast = self.measure(lambda: self.get(url, fast=True), iterations)
+        self.report('GET /store/products/', regular, fast)
+
+    def report(self, label, regular, fast):
+        print(f'{label:<24} ProductSerializer {regular:8.2f} ms CPU   '
+              f'values() {fast:8.2f} ms CPU   {regular / fast:5.1f}x')
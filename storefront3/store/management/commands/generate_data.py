@@ -0,0 +1,306 @@
+import itertools
+import multiprocessing
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from uuid import uuid4
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, connections
+from django.db.models import Max
+from django.utils import timezone
+from core.models import User
+from likes.models import LikedItem
+from store.cache import CATALOG, COLLECTIONS, bump_namespace
+from store.models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, ProductImage, Review
+from tags.models import Tag, TaggedItem
+
+
+WORDS = (
+    'organic fresh classic premium deluxe mini large family pack spicy sweet '
+    'smoked frozen roasted wild golden green red crispy creamy dark light '
+    'bread cheese coffee tea rice pasta sauce soap brush paper pen toy dog '
+    'cat flower cake spice olive honey juice wine chocolate candle towel'
+).split()
+
+# Filled in by the parent before the order workers are forked.
+_catalog = {}
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def next_id(model):
+    return (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+
+@contextmanager
+def explicit_timestamps(model, field_name):
+    """
+    Lets bulk_create keep the values we generate for an auto_now_add field
+    instead of stamping every row with the current time.
+    """
+    field = model._meta.get_field(field_name)
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def zipf_weights(count, exponent, rng):
+    """
+    Cumulative Zipf weights over a shuffled ranking, so the popular items
+    are spread across the id range instead of being the lowest ids.
+    """
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    return list(itertools.accumulate(1 / rank ** exponent for rank in ranks))
+
+
+def generate_orders(task):
+    start_id, count, seed = task
+    rng = random.Random(seed)
+    product_ids = _catalog['product_ids']
+    prices = _catalog['prices']
+    weights = _catalog['weights']
+    customer_ids = _catalog['customer_ids']
+    batch_size = _catalog['batch_size']
+    items_per_order = _catalog['items_per_order']
+    now = timezone.now()
+    statuses = [Order.PAYMENT_STATUS_COMPLETE] * 8 + [Order.PAYMENT_STATUS_PENDING, Order.PAYMENT_STATUS_FAILED]
+
+    created_items = 0
+    for ids in batched(range(start_id, start_id + count), batch_size):
+        orders = [
+            Order(id=order_id,
+                  customer_id=rng.choice(customer_ids),
+                  payment_status=rng.choice(statuses),
+                  placed_at=now - timedelta(seconds=rng.uniform(0, 365 * 24 * 3600)))
+            for order_id in ids]
+        Order.objects.bulk_create(orders)
+
+        items = []
+        for order_id in ids:
+            size = max(1, min(int(rng.expovariate(1 / items_per_order)) + 1, 50))
+            for index in rng.choices(range(len(product_ids)), cum_weights=weights, k=size):
+                items.append(OrderItem(
+                    order_id=order_id,
+                    product_id=product_ids[index],
+                    quantity=rng.randint(1, 5),
+                    unit_price=prices[index]))
+        OrderItem.objects.bulk_create(items, batch_size=batch_size)
+        created_items += len(items)
+
+    connection.close()
+    return count, created_items
+
+
+class Command(BaseCommand):
+    help = 'Generates a large synthetic dataset with skewed product popularity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collections', type=int, default=50)
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--images-per-product', type=float, default=1.5)
+        parser.add_argument('--customers', type=int, default=50000)
+        parser.add_argument('--orders', type=int, default=500000)
+        parser.add_argument('--items-per-order', type=float, default=3,
+                            help='Mean number of items per order')
+        parser.add_argument('--carts', type=int, default=10000)
+        parser.add_argument('--reviews', type=int, default=100000)
+        parser.add_argument('--tags', type=int, default=200)
+        parser.add_argument('--tagged-items', type=int, default=200000)
+        parser.add_argument('--likes', type=int, default=200000)
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Popularity skew; higher concentrates traffic on fewer products')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes generating orders (keep at 1 on SQLite)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        collection_ids = self.create_collections()
+        self.create_products(collection_ids)
+        self.create_images()
+        customer_ids = self.create_customers()
+        self.create_orders(customer_ids)
+        self.create_carts()
+        self.create_reviews()
+        self.create_tags()
+        self.create_likes()
+
+        self.reset_sequences()
+        bump_namespace(CATALOG)
+        bump_namespace(COLLECTIONS)
+        print(f'Done in {time.perf_counter() - started:.1f}s.')
+
+    def insert(self, model, objs, **kwargs):
+        total = 0
+        for batch in batched(objs, self.batch_size):
+            model.objects.bulk_create(batch, **kwargs)
+            total += len(batch)
+        print(f'  {model.__name__}: {total} rows')
+        return total
+
+    def words(self, count):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(count))
+
+    def pick_products(self, count):
+        indexes = self.rng.choices(range(len(self.product_ids)), cum_weights=self.weights, k=count)
+        return [self.product_ids[index] for index in indexes]
+
+    def create_collections(self):
+        start = next_id(Collection)
+        ids = range(start, start + self.options['collections'])
+        self.insert(Collection, (
+            Collection(id=collection_id, title=f'{self.words(2).title()} {collection_id}')
+            for collection_id in ids))
+        return list(ids)
+
+    def create_products(self, collection_ids):
+        start = next_id(Product)
+        count = self.options['products']
+        self.product_ids = list(range(start, start + count))
+        self.prices = [Decimal(self.rng.randint(100, 99999)) / 100 for _ in range(count)]
+        self.weights = zipf_weights(count, self.options['zipf'], self.rng)
+        # Collection sizes are skewed too.
+        collection_weights = zipf_weights(len(collection_ids), 0.8, self.rng)
+        collections = self.rng.choices(collection_ids, cum_weights=collection_weights, k=count)
+
+        def products():
+            for index, product_id in enumerate(self.product_ids):
+                title = f'{self.words(3).title()} {product_id}'
+                yield Product(
+                    id=product_id,
+                    title=title,
+                    slug=title.lower().replace(' ', '-'),
+                    description=self.words(self.rng.randint(5, 40)),
+                    unit_price=self.prices[index],
+                    inventory=self.rng.randint(0, 1000),
+                    collection_id=collections[index])
+
+        self.insert(Product, products())
+
+    def create_images(self):
+        def images():
+            for product_id in self.product_ids:
+                for _ in range(int(self.rng.expovariate(1 / self.options['images_per_product']))):
+                    yield ProductImage(product_id=product_id, image=f'store/images/generated-{product_id}.png')
+
+        self.insert(ProductImage, images())
+
+    def create_customers(self):
+        start = next_id(User)
+        user_ids = range(start, start + self.options['customers'])
+        self.user_ids = list(user_ids)
+        memberships = [Customer.MEMBERSHIP_BRONZE] * 7 + [Customer.MEMBERSHIP_SILVER] * 2 + [Customer.MEMBERSHIP_GOLD]
+        self.insert(User, (
+            User(id=user_id,
+                 username=f'user{user_id}',
+                 email=f'user{user_id}@example.com',
+                 first_name=self.rng.choice(WORDS).title(),
+                 last_name=self.rng.choice(WORDS).title(),
+                 password='!')
+            for user_id in user_ids))
+
+        # bulk_create skips the signal that creates a customer per user.
+        start = next_id(Customer)
+        customer_ids = list(range(start, start + len(user_ids)))
+        self.insert(Customer, (
+            Customer(id=customer_id, user_id=user_id, phone=f'555-{user_id:07d}',
+                     membership=self.rng.choice(memberships))
+            for customer_id, user_id in zip(customer_ids, user_ids)))
+        return customer_ids
+
+    def create_orders(self, customer_ids):
+        count = self.options['orders']
+        if not count or not customer_ids:
+            return
+        _catalog.update(
+            product_ids=self.product_ids,
+            prices=self.prices,
+            weights=self.weights,
+            customer_ids=customer_ids,
+            batch_size=self.batch_size,
+            items_per_order=self.options['items_per_order'])
+
+        start = next_id(Order)
+        workers = max(1, self.options['workers'])
+        chunk = -(-count // workers)
+        tasks = [(start + offset, min(chunk, count - offset), self.options['seed'] + offset)
+                 for offset in range(0, count, chunk)]
+
+        with explicit_timestamps(Order, 'placed_at'):
+            if workers == 1:
+                results = [generate_orders(task) for task in tasks]
+            else:
+                # Forked children must not share the parent's connection.
+                connections.close_all()
+                with multiprocessing.get_context('fork').Pool(workers) as pool:
+                    results = pool.map(generate_orders, tasks)
+
+        print(f'  Order: {sum(orders for orders, _ in results)} rows')
+        print(f'  OrderItem: {sum(items for _, items in results)} rows')
+
+    def create_carts(self):
+        carts = [Cart(id=uuid4()) for _ in range(self.options['carts'])]
+        self.insert(Cart, carts)
+
+        def items():
+            for cart in carts:
+                size = self.rng.randint(1, 6)
+                for product_id in set(self.pick_products(size)):
+                    yield CartItem(cart_id=cart.id, product_id=product_id, quantity=self.rng.randint(1, 3))
+
+        self.insert(CartItem, items())
+
+    def create_reviews(self):
+        product_ids = self.pick_products(self.options['reviews'])
+        self.insert(Review, (
+            Review(product_id=product_id, name=self.rng.choice(WORDS).title(), description=self.words(12))
+            for product_id in product_ids))
+
+    def create_tags(self):
+        start = next_id(Tag)
+        tag_ids = list(range(start, start + self.options['tags']))
+        if not tag_ids:
+            return
+        self.insert(Tag, (Tag(id=tag_id, label=f'{self.rng.choice(WORDS)}-{tag_id}') for tag_id in tag_ids))
+        content_type = ContentType.objects.get_for_model(Product)
+        product_ids = self.pick_products(self.options['tagged_items'])
+        self.insert(TaggedItem, (
+            TaggedItem(tag_id=self.rng.choice(tag_ids), content_type=content_type, object_id=product_id)
+            for product_id in product_ids))
+
+    def create_likes(self):
+        if not self.user_ids:
+            return
+        content_type = ContentType.objects.get_for_model(Product)
+        product_ids = self.pick_products(self.options['likes'])
+        self.insert(LikedItem, (
+            LikedItem(user_id=self.rng.choice(self.user_ids), content_type=content_type, object_id=product_id)
+            for product_id in product_ids))
+
+    def reset_sequences(self):
+        # Explicit ids leave PostgreSQL sequences behind; MySQL and SQLite
+        # move their counters on their own.
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [Collection, Product, User, Customer, Order, Tag])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
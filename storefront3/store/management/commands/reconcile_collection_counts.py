@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from store.models import Collection
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Collection.products_count from the product table'
+
+    def handle(self, *args, **options):
+        repaired = Collection.objects.reconcile_products_count()
+        print(f'Repaired {repaired} collection(s).')
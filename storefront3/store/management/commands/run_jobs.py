@@ -0,0 +1,50 @@
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from store.jobs import claim_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs (order events) with a pool of worker threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the queue is drained instead of polling forever')
+
+    def handle(self, *args, **options):
+        stats = {'done': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def work():
+            try:
+                while True:
+                    close_old_connections()
+                    jobs = list(claim_jobs(options['batch_size']))
+                    if not jobs:
+                        if options['once']:
+                            return
+                        time.sleep(options['poll_interval'])
+                        continue
+                    for job in jobs:
+                        succeeded = run_job(job)
+                        with lock:
+                            stats['done' if succeeded else 'failed'] += 1
+            finally:
+                connection.close()
+
+        print(f"Starting {options['workers']} worker(s)...")
+        threads = [threading.Thread(target=work, daemon=True)
+                   for _ in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            pass
+        print(f"Jobs completed: {stats['done']}, attempts failed: {stats['failed']}")
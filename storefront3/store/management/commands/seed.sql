@@ -1,16 +1,16 @@
 insert into
-  store_collection (id, title, featured_product_id)
+  store_collection (id, title, featured_product_id, products_count)
 values
-  (1, 'Flowers', null),
-  (2, 'Grocery', null),
-  (3, 'Beauty', null),
-  (4, 'Cleaning', null),
-  (5, 'Stationary', null),
-  (6, 'Pets', null),
-  (7, 'Baking', null),
-  (8, 'Spices', null),
-  (9, 'Toys', null),
-  (10, 'Magazines', null);
+  (1, 'Flowers', null, 0),
+  (2, 'Grocery', null, 0),
+  (3, 'Beauty', null, 0),
+  (4, 'Cleaning', null, 0),
+  (5, 'Stationary', null, 0),
+  (6, 'Pets', null, 0),
+  (7, 'Baking', null, 0),
+  (8, 'Spices', null, 0),
+  (9, 'Toys', null, 0),
+  (10, 'Magazines', null, 0);
 
 insert into
   store_product (
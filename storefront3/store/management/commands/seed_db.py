@@ -1,17 +1,211 @@
-from django.core.management.base import BaseCommand
-from django.db import connection
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 from pathlib import Path
+from store.cache import CATALOG, COLLECTIONS, COLLECTIONS_MARKER, PRODUCT_IMAGES_MARKER, PRODUCTS_MARKER, \
+    bump_namespace, touch_marker
+from store.models import Collection
+from store.search import get_search_backend
+import csv
+import json
 import os
 
 
+def split_statements(file, offset=0):
+    """
+    Yields (statement, end_offset) for each `;`-terminated statement in a
+    binary SQL file, starting at byte `offset`. Semicolons inside quotes,
+    backticks and comments are ignored. `end_offset` is the byte position
+    just past the statement, so loading can resume from it.
+    """
+    file.seek(offset)
+    buffer = []
+    quote = None
+    block_comment = False
+    position = offset
+
+    for raw_line in iter(file.readline, b''):
+        line = raw_line.decode('utf-8')
+        start = 0
+        i = 0
+        while i < len(line):
+            char = line[i]
+            pair = line[i:i + 2]
+            if block_comment:
+                if pair == '*/':
+                    block_comment = False
+                    i += 1
+            elif quote:
+                if char == '\\' and quote != '`':
+                    i += 1
+                elif char == quote:
+                    quote = None
+            elif pair == '--' or char == '#':
+                break
+            elif pair == '/*':
+                block_comment = True
+                i += 1
+            elif char in '\'"`':
+                quote = char
+            elif char == ';':
+                buffer.append(line[start:i])
+                statement = ''.join(buffer).strip()
+                buffer = []
+                start = i + 1
+                if statement:
+                    yield statement, position + len(line[:start].encode('utf-8'))
+            i += 1
+        else:
+            buffer.append(line[start:])
+            position += len(raw_line)
+            continue
+        # A line comment: keep the code before it, drop the rest.
+        buffer.append(line[start:i] + '\n')
+        position += len(raw_line)
+
+    statement = ''.join(buffer).strip()
+    if statement and not statement.startswith(('--', '#')):
+        yield statement, position
+
+
+def read_rows(file, file_format, offset=0):
+    """
+    Yields (row, end_offset) from a binary CSV (with a header) or NDJSON
+    file. Returns the column names first. A quoted CSV field may span
+    lines, so `end_offset` is taken after the whole record, never inside it.
+    """
+    position = 0
+
+    def lines():
+        # Counts the bytes handed to the parser; csv.reader only pulls the
+        # lines of the record it is parsing, so after each record this is
+        # where the next one starts.
+        nonlocal position
+        position = file.tell()
+        for raw_line in iter(file.readline, b''):
+            position += len(raw_line)
+            yield raw_line.decode('utf-8')
+
+    if file_format == 'csv':
+        columns = next(csv.reader(lines()))
+    else:
+        columns = list(json.loads(file.readline()))
+        file.seek(0)
+
+    def rows():
+        if offset:
+            file.seek(offset)
+        if file_format == 'csv':
+            for values in csv.reader(lines()):
+                if values:
+                    yield [None if value == '' else value for value in values], position
+        else:
+            for line in lines():
+                if line.strip():
+                    record = json.loads(line)
+                    yield [record.get(column) for column in columns], position
+
+    return columns, rows()
+
+
 class Command(BaseCommand):
-    help = 'Populates the database with collections and products'
+    help = 'Populates the database from a SQL dump, or a CSV/NDJSON file for one table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='Defaults to the bundled seed.sql')
+        parser.add_argument('--format', choices=['sql', 'csv', 'ndjson'],
+                            help='Defaults to the file extension')
+        parser.add_argument('--table', help='Target table for CSV/NDJSON (defaults to the file name)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Statements or rows per transaction')
+        parser.add_argument('--offset', type=int, default=0,
+                            help='Byte offset to resume from, as printed by a previous run')
 
     def handle(self, *args, **options):
         print('Populating the database...')
         current_dir = os.path.dirname(__file__)
-        file_path = os.path.join(current_dir, 'seed.sql')
-        sql = Path(file_path).read_text()
+        path = Path(options['file'] or os.path.join(current_dir, 'seed.sql'))
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format == 'json':
+            file_format = 'ndjson'
+        if file_format not in ('sql', 'csv', 'ndjson'):
+            raise CommandError(f'Unknown format for {path}, pass --format.')
+
+        with path.open('rb') as file:
+            if file_format == 'sql':
+                self.load_sql(file, options)
+            else:
+                table = options['table'] or path.stem
+                if connection.vendor == 'mysql' and file_format == 'csv' and not options['offset']:
+                    self.load_data_infile(path, table)
+                else:
+                    self.load_rows(file, file_format, table, options)
+
+        # Raw inserts skip the signals that maintain the counter.
+        Collection.objects.reconcile_products_count()
+        bump_namespace(CATALOG)
+        bump_namespace(COLLECTIONS)
+        for marker in (PRODUCTS_MARKER, PRODUCT_IMAGES_MARKER, COLLECTIONS_MARKER):
+            touch_marker(marker)
+        get_search_backend().invalidate()
+
+    def run_batches(self, items, batch_size, execute):
+        """
+        Executes items in transactions of `batch_size`, reporting the offset
+        after each commit so an interrupted load can be resumed.
+        """
+        done = 0
+        batch = []
+        offset = None
+        for item, offset in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                with transaction.atomic():
+                    execute(batch)
+                done += len(batch)
+                batch = []
+                print(f'  {done} loaded, resume with --offset {offset}')
+        if batch:
+            with transaction.atomic():
+                execute(batch)
+            done += len(batch)
+        print(f'Loaded {done} in total.')
+
+    def load_sql(self, file, options):
+        def execute(statements):
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+
+        self.run_batches(
+            split_statements(file, options['offset']), options['batch_size'], execute)
+
+    def load_rows(self, file, file_format, table, options):
+        columns, rows = read_rows(file, file_format, options['offset'])
+        quote_name = connection.ops.quote_name
+        sql = (
+            f'INSERT INTO {quote_name(table)} '
+            f'({", ".join(quote_name(column) for column in columns)}) '
+            f'VALUES ({", ".join(["%s"] * len(columns))})'
+        )
+
+        def execute(batch):
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+
+        self.run_batches(rows, options['batch_size'], execute)
 
+    def load_data_infile(self, path, table):
+        # Requires local_infile enabled on both the server and the client
+        # connection (DATABASES OPTIONS {'local_infile': 1}).
+        with path.open('rb') as file:
+            columns = next(csv.reader([file.readline().decode('utf-8')]))
+        quote_name = connection.ops.quote_name
         with connection.cursor() as cursor:
-            cursor.execute(sql)
+            cursor.execute(
+                f"LOAD DATA LOCAL INFILE %s INTO TABLE {quote_name(table)} "
+                f"CHARACTER SET utf8mb4 "
+                f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+                f"LINES TERMINATED BY '\\n' IGNORE 1 LINES "
+                f"({', '.join(quote_name(column) for column in columns)})",
+                [str(path.resolve())])
+            print(f'Loaded {cursor.rowcount} rows with LOAD DATA LOCAL INFILE.')
@@ -0,0 +1,111 @@
+import re
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+from django.urls import get_resolver
+from store.cache import cache_stats, get_cache
+
+
+# Matches the request and status of common/combined log lines, e.g.
+# "GET /store/products/?page=2 HTTP/1.1" 200
+LOG_LINE = re.compile(r'"(?:GET|HEAD) (?P<path>\S+) HTTP/[\d.]+" (?P<status>\d{3})')
+CATALOG_PREFIXES = ('/store/products/', '/store/collections/')
+DEFAULT_URLS = ['/store/collections/', '/store/products/']
+
+
+def top_urls(log_path, limit):
+    """
+    Returns the `limit` catalog paths that were served successfully most
+    often in an access log.
+    """
+    counts = Counter()
+    with open(log_path, errors='replace') as file:
+        for line in file:
+            match = LOG_LINE.search(line)
+            if match and match['status'] == '200' and match['path'].startswith(CATALOG_PREFIXES):
+                counts[match['path']] += 1
+    return [path for path, _ in counts.most_common(limit)]
+
+
+def cache_writes(stats):
+    # Tiered caches count their writes; response caches write once per miss.
+    return sum(entry.get('sets', 0) for entry in stats.values()) \
+        + stats['responses'].get('misses', 0) \
+        + stats['revalidated'].get('misses', 0)
+
+
+class Command(BaseCommand):
+    help = 'Fills the catalog caches by replaying the most requested catalog URLs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', help='Access log (common/combined format) to take the top URLs from')
+        parser.add_argument('--url', action='append', dest='urls',
+                            help='A URL to warm; repeat for several (defaults to STORE_WARM_URLS)')
+        parser.add_argument('--limit', type=int, default=100, help='How many URLs to take from the log')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--host', default='127.0.0.1:8000',
+                            help='Host the responses are cached for; it is part of the cache key')
+        parser.add_argument('--base-url',
+                            help='Send real requests to a running server (e.g. http://127.0.0.1:8000) '
+                                 'so its per-process caches warm up too')
+
+    def handle(self, *args, **options):
+        urls = list(options['urls'] or [])
+        if options['log']:
+            urls += top_urls(options['log'], options['limit'])
+        if not urls:
+            urls = getattr(settings, 'STORE_WARM_URLS', DEFAULT_URLS)
+
+        if options['base_url']:
+            fetch = self.remote_fetcher(options['base_url'])
+        else:
+            if isinstance(get_cache(), LocMemCache):
+                print('Warning: the default cache is local memory, so only this process would see '
+                      'the entries. Use --base-url or a shared CACHE_BACKEND.')
+            # In-process lookups that every request needs.
+            get_resolver()._populate()
+            ContentType.objects.get_for_models(*apps.get_models())
+            fetch = self.local_fetcher(options['host'])
+
+        writes = cache_writes(cache_stats())
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, options['concurrency'])) as executor:
+            results = list(executor.map(fetch, urls))
+        elapsed = time.perf_counter() - started
+
+        statuses = Counter(status for _, status, _ in results)
+        for url, status, size in results:
+            if status != 200:
+                print(f'  {status} {url}')
+        print(f'Warmed {len(urls)} URLs in {elapsed:.2f}s '
+              f'({", ".join(f"{count} x {status}" for status, count in sorted(statuses.items()))}), '
+              f'{sum(size for _, _, size in results)} response bytes.')
+        if not options['base_url']:
+            print(f'Filled {cache_writes(cache_stats()) - writes} cache entries.')
+
+    def local_fetcher(self, host):
+        def fetch(url):
+            try:
+                response = Client(HTTP_HOST=host).get(url)
+                return url, response.status_code, len(response.content)
+            finally:
+                connections.close_all()
+        return fetch
+
+    def remote_fetcher(self, base_url):
+        def fetch(url):
+            try:
+                with urllib.request.urlopen(base_url.rstrip('/') + url, timeout=30) as response:
+                    return url, response.status, len(response.read())
+            except urllib.error.HTTPError as error:
+                return url, error.code, 0
+        return fetch
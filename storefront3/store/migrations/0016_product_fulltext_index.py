@@ -0,0 +1,27 @@
+# Generated by Django 4.2.27 on 2026-10-18 06:41
+
+from django.db import migrations
+
+
+def add_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            'ALTER TABLE store_product '
+            'ADD FULLTEXT INDEX store_product_fulltext (title, description)')
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            'ALTER TABLE store_product DROP INDEX store_product_fulltext')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_fulltext_index, drop_fulltext_index),
+    ]
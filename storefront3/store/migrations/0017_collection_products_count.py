@@ -0,0 +1,33 @@
+# Generated by Django 4.2.27 on 2026-10-18 06:34
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_products_count(apps, schema_editor):
+    Collection = apps.get_model('store', 'Collection')
+    Product = apps.get_model('store', 'Product')
+    counts = Product.objects \
+        .order_by() \
+        .values('collection_id') \
+        .annotate(count=Count('id'))
+    for row in counts:
+        Collection.objects \
+            .filter(pk=row['collection_id']) \
+            .update(products_count=row['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_product_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_products_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+from rest_framework.response import Response
+
+
+class ValuesListMixin:
+    """
+    An opt-in fast path for list: when `values_serializer_class` is set,
+    rows are read with values() and serialized without model instances.
+    """
+    values_serializer_class = None
+
+    def use_values_serializer(self):
+        return self.values_serializer_class is not None
+
+    def get_values_serializer(self):
+        return self.values_serializer_class(context=self.get_serializer_context())
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_values_serializer():
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_values_serializer()
+        rows = serializer.get_rows(queryset)
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(list(rows)))
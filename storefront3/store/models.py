@@ -1,9 +1,15 @@
 from django.contrib import admin
 from django.conf import settings
 from django.core.validators import MinValueValidator
-from django.db import models
+from collections import Counter
+from django.db import connections, models, transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from uuid import uuid4
 
+from store.cache import CATALOG, COLLECTIONS, PRODUCTS_MARKER, bump_namespace, touch_marker
+from store.search import get_search_backend
 from store.validators import validate_file_size
 
 
@@ -12,18 +18,141 @@ class Promotion(models.Model):
     discount = models.FloatField()
 
 
+class CollectionManager(models.Manager):
+    def adjust_products_count(self, deltas):
+        adjusted = False
+        for collection_id, delta in deltas.items():
+            if collection_id is not None and delta:
+                # Clamped at zero so drift can't fail the write that exposed
+                # it (reconcile_collection_counts repairs it). A CASE rather
+                # than GREATEST: MySQL rejects an unsigned column going
+                # negative even as an intermediate value.
+                count = F('products_count') + delta
+                if delta < 0:
+                    count = Case(When(products_count__gte=-delta, then=count), default=Value(0))
+                adjusted = self.filter(pk=collection_id).update(products_count=count) or adjusted
+        if adjusted:
+            # Counter updates skip the Collection signals; cached
+            # collections still need to go.
+            transaction.on_commit(lambda: bump_namespace(COLLECTIONS), using=self.db)
+
+    def reconcile_products_count(self):
+        """
+        Recomputes every stored products_count from the product table and
+        returns the number of collections that had drifted.
+        """
+        actual = Product.objects \
+            .filter(collection_id=OuterRef('pk')) \
+            .order_by() \
+            .values('collection_id') \
+            .annotate(count=Count('id')) \
+            .values('count')
+        drifted = self.annotate(actual_count=Coalesce(Subquery(actual), 0)) \
+            .exclude(products_count=F('actual_count')) \
+            .update(products_count=Coalesce(Subquery(actual), 0))
+        if drifted:
+            transaction.on_commit(lambda: bump_namespace(COLLECTIONS), using=self.db)
+        return drifted
+
+
 class Collection(models.Model):
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, null=True, related_name='+', blank=True)
+    # Maintained by the Product signals and ProductQuerySet bulk paths;
+    # `manage.py reconcile_collection_counts` repairs any drift.
+    products_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CollectionManager()
 
     def __str__(self) -> str:
         return self.title
 
+    def save(self, *args, **kwargs):
+        # Saving a loaded copy must not write back a stale products_count.
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'products_count']
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['title']
 
 
+class ProductQuerySet(models.QuerySet):
+    """
+    Keeps Collection.products_count in step and drops the cached catalog on
+    the bulk paths that bypass model signals. Deletes still send
+    post_delete for every product.
+    """
+
+    def invalidate_catalog(self, search=False):
+        def invalidate():
+            bump_namespace(CATALOG)
+            touch_marker(PRODUCTS_MARKER)
+            if search:
+                get_search_backend().invalidate()
+        transaction.on_commit(invalidate, using=self.db)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            Collection.objects.adjust_products_count(
+                Counter(obj.collection_id for obj in objs))
+            if objs:
+                self.invalidate_catalog(search=True)
+        return objs
+
+    def update(self, **kwargs):
+        if 'collection' not in kwargs and 'collection_id' not in kwargs:
+            updated = super().update(**kwargs)
+            if updated:
+                self.invalidate_catalog(search=bool({'title', 'description'} & kwargs.keys()))
+            return updated
+
+        with transaction.atomic(using=self.db):
+            moved = self.order_by() \
+                .values('collection_id') \
+                .annotate(count=Count('id'))
+            deltas = Counter()
+            for row in moved:
+                deltas[row['collection_id']] -= row['count']
+            updated = super().update(**kwargs)
+            target = kwargs.get('collection_id', kwargs.get('collection'))
+            deltas[getattr(target, 'pk', target)] += updated
+            Collection.objects.adjust_products_count(deltas)
+            if updated:
+                self.invalidate_catalog()
+        return updated
+
+    def decrement_inventory(self, quantities):
+        """
+        Takes {product_id: quantity} off inventory in one UPDATE that only
+        matches products with enough stock, and returns the ids that fell
+        short; on a shortfall nothing is decremented. Rows are updated in id
+        order so concurrent checkouts lock them in the same order. Must be
+        called inside a transaction.
+        """
+        demand = Case(
+            *[When(id=product_id, then=Value(quantity))
+              for product_id, quantity in quantities.items()],
+            output_field=IntegerField())
+        savepoint = transaction.savepoint(using=self.db)
+        updated = self \
+            .filter(id__in=quantities.keys(), inventory__gte=demand) \
+            .order_by('id') \
+            .update(inventory=F('inventory') - demand, last_update=timezone.now())
+        if updated == len(quantities):
+            transaction.savepoint_commit(savepoint, using=self.db)
+            return []
+
+        transaction.savepoint_rollback(savepoint, using=self.db)
+        return list(self
+                    .filter(id__in=quantities.keys(), inventory__lt=demand)
+                    .values_list('id', flat=True))
+
+
 class Product(models.Model):
     title = models.CharField(max_length=255)
     slug = models.SlugField()
@@ -38,11 +167,19 @@ class Product(models.Model):
         Collection, on_delete=models.PROTECT, related_name='products')
     promotions = models.ManyToManyField(Promotion, blank=True)
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self) -> str:
         return self.title
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            # Keyset pagination seeks on (ordering field, id).
+            models.Index(fields=['title', 'id']),
+            models.Index(fields=['unit_price', 'id']),
+            models.Index(fields=['last_update', 'id']),
+        ]
 
 class ProductImage(models.Model):
     product = models.ForeignKey(
@@ -104,6 +241,12 @@ class Order(models.Model):
         permissions = [
             ('cancel_order', 'Can cancel order')
         ]
+        indexes = [
+            # Order history is paginated by placed_at, per customer and
+            # across all customers for staff.
+            models.Index(fields=['customer', 'placed_at']),
+            models.Index(fields=['placed_at', 'id']),
+        ]
 
 
 class OrderItem(models.Model):
@@ -126,6 +269,50 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+class CartItemManager(models.Manager):
+    def with_total_price(self):
+        return self.annotate(total_price=ExpressionWrapper(
+            F('quantity') * F('product__unit_price'),
+            output_field=DecimalField(max_digits=12, decimal_places=2)))
+
+    def add(self, cart_id, product_id, quantity):
+        """
+        Inserts the item or increments its quantity in a single statement.
+        The row is selected from the product table, so an unknown product
+        inserts nothing and None is returned.
+        """
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self.model._meta.db_table)
+        cart_id = self.model._meta.get_field('cart').get_db_prep_value(cart_id, connection)
+        sql = (
+            f'INSERT INTO {table} (cart_id, product_id, quantity) '
+            f'SELECT %s, id, %s FROM {quote_name(Product._meta.db_table)} WHERE id = %s '
+        )
+        params = [cart_id, quantity, product_id]
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                # MySQL has no RETURNING, so read the row back afterwards.
+                cursor.execute(
+                    sql + 'ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)',
+                    params)
+                if cursor.rowcount == 0:
+                    return None
+                return self.get(cart_id=cart_id, product_id=product_id)
+
+            cursor.execute(
+                sql + f'ON CONFLICT (cart_id, product_id) '
+                f'DO UPDATE SET quantity = {table}.quantity + excluded.quantity '
+                f'RETURNING id, quantity',
+                params)
+            row = cursor.fetchone()
+
+        if row is None:
+            return None
+        return self.model(id=row[0], cart_id=cart_id, product_id=product_id, quantity=row[1])
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(
         Cart, on_delete=models.CASCADE, related_name='items')
@@ -134,6 +321,8 @@ class CartItem(models.Model):
         validators=[MinValueValidator(1)]
     )
 
+    objects = CartItemManager()
+
     class Meta:
         unique_together = [['cart', 'product']]
 
@@ -144,3 +333,45 @@ class Review(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     date = models.DateField(auto_now_add=True)
+
+
+class JobManager(models.Manager):
+    def enqueue(self, name, **payload):
+        """
+        Queues a job in the caller's transaction, so it only becomes visible
+        to workers if that transaction commits.
+        """
+        return self.create(name=name, payload=payload)
+
+
+class Job(models.Model):
+    STATUS_PENDING = 'P'
+    STATUS_RUNNING = 'R'
+    STATUS_DONE = 'D'
+    STATUS_FAILED = 'F'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=1, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = JobManager()
+
+    def __str__(self) -> str:
+        return f'{self.name} #{self.id}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
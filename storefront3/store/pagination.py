@@ -1,4 +1,120 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 class DefaultPagination(PageNumberPagination):
-  page_size = 10
\ No newline at end of file
+  page_size = 10
+
+
+class KeysetPagination(CursorPagination):
+  """
+  Cursor pagination that seeks on the full ordering plus an id tiebreaker,
+  so every page is an indexed range scan and no COUNT(*) is ever issued.
+  """
+  page_size = 10
+  ordering = 'id'
+  tiebreaker = 'id'
+
+  def get_ordering(self, request, queryset, view):
+    ordering = list(super().get_ordering(request, queryset, view))
+    fields = [field.lstrip('-') for field in ordering]
+    if self.tiebreaker not in fields and 'pk' not in fields:
+      # Follow the direction of the leading field so a composite
+      # (field, id) index can serve the whole scan.
+      prefix = '-' if ordering[0].startswith('-') else ''
+      ordering.append(prefix + self.tiebreaker)
+    return tuple(ordering)
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.request = request
+    self.page_size = self.get_page_size(request)
+    if not self.page_size:
+      return None
+
+    self.base_url = request.build_absolute_uri()
+    self.ordering = self.get_ordering(request, queryset, view)
+
+    self.cursor = self.decode_cursor(request)
+    if self.cursor is None:
+      reverse, current_position = False, None
+    else:
+      _, reverse, current_position = self.cursor
+
+    if reverse:
+      queryset = queryset.order_by(*[self._flip(field) for field in self.ordering])
+    else:
+      queryset = queryset.order_by(*self.ordering)
+
+    if current_position is not None:
+      queryset = queryset.filter(self._seek(current_position, reverse))
+
+    # Fetch one extra row to find out whether another page follows.
+    results = list(queryset[:self.page_size + 1])
+    self.page = results[:self.page_size]
+
+    if len(results) > len(self.page):
+      has_following_position = True
+      following_position = self._get_position_from_instance(results[-1], self.ordering)
+    else:
+      has_following_position = False
+      following_position = None
+
+    if reverse:
+      self.page = list(reversed(self.page))
+      self.has_next = current_position is not None
+      self.has_previous = has_following_position
+      if self.has_next:
+        self.next_position = current_position
+      if self.has_previous:
+        self.previous_position = following_position
+    else:
+      self.has_next = has_following_position
+      self.has_previous = current_position is not None
+      if self.has_next:
+        self.next_position = following_position
+      if self.has_previous:
+        self.previous_position = current_position
+
+    if (self.has_previous or self.has_next) and self.template is not None:
+      self.display_page_controls = True
+
+    return self.page
+
+  def _get_position_from_instance(self, instance, ordering):
+    values = []
+    for field in ordering:
+      name = field.lstrip('-')
+      value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+      values.append(None if value is None else str(value))
+    return json.dumps(values)
+
+  def _seek(self, position, reverse):
+    """
+    Build the row-value comparison `(a, b, id) > (x, y, z)` as nested ORs,
+    honouring the direction of each ordering field.
+    """
+    try:
+      values = json.loads(position)
+    except ValueError:
+      raise NotFound(self.invalid_cursor_message)
+    if not isinstance(values, list) or len(values) != len(self.ordering):
+      raise NotFound(self.invalid_cursor_message)
+
+    condition = Q()
+    equal = {}
+    for field, value in zip(self.ordering, values):
+      name = field.lstrip('-')
+      descending = field.startswith('-') != reverse
+      lookup = name + ('__lt' if descending else '__gt')
+      condition |= Q(**equal, **{lookup: value})
+      equal[name] = value
+    return condition
+
+  @staticmethod
+  def _flip(field):
+    return field[1:] if field.startswith('-') else '-' + field
+
+
+class OrderHistoryPagination(KeysetPagination):
+  ordering = '-placed_at'
@@ -0,0 +1,134 @@
+import logging
+import re
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+VALUE_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+
+
+def query_shape(sql):
+    """
+    Reduces a query to its shape by replacing parameters and literals with
+    `?` and collapsing IN lists, so queries that only differ by value match.
+    """
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    return VALUE_LIST.sub('?...', sql)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder:
+    """
+    An execute wrapper that records every SQL statement run through it.
+    Unlike connection.queries it works with DEBUG off.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def repeated(self, threshold=3):
+        """
+        Returns {shape: count} for shapes run at least `threshold` times,
+        the signature of an N+1 query.
+        """
+        shapes = Counter(query_shape(sql) for sql in self.queries)
+        return {shape: count for shape, count in shapes.items() if count >= threshold}
+
+
+@contextmanager
+def record_queries():
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        yield recorder
+
+
+@contextmanager
+def assert_queries_within(budget, threshold=3):
+    """
+    For tests: fails if the block runs more than `budget` queries or
+    repeats any query shape `threshold` times.
+    """
+    with record_queries() as recorder:
+        yield recorder
+    if recorder.count > budget:
+        raise QueryBudgetExceeded(f'{recorder.count} queries, budget is {budget}')
+    repeated = recorder.repeated(threshold)
+    if repeated:
+        raise QueryBudgetExceeded(f'Repeated query shapes: {repeated}')
+
+
+def get_query_budget(request):
+    """
+    Reads `query_budget` from the viewset that served the request: either an
+    int for every action or a {action: int} dict.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    budget = getattr(getattr(match.func, 'cls', None), 'query_budget', None)
+    if isinstance(budget, dict):
+        actions = getattr(match.func, 'actions', None) or {}
+        return budget.get(actions.get(request.method.lower()))
+    return budget
+
+
+def check_queries(request, recorder):
+    """
+    Returns a list of problems with the queries a request ran: going over
+    its viewset's budget, and query shapes repeated often enough to be N+1.
+    """
+    problems = []
+    budget = get_query_budget(request)
+    if budget is not None and recorder.count > budget:
+        problems.append(f'{recorder.count} queries, budget is {budget}')
+
+    threshold = getattr(settings, 'STORE_QUERY_REPEAT_THRESHOLD', 3)
+    for shape, count in recorder.repeated(threshold).items():
+        problems.append(f'repeated {count} times: {shape}')
+    return problems
+
+
+class QueryBudgetMiddleware:
+    """
+    Records the queries of every request, adds an X-Query-Count header and
+    logs requests that break their budget or repeat a query shape. With
+    STORE_QUERY_BUDGET_STRICT on (in tests) it raises QueryBudgetExceeded
+    instead.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries() as recorder:
+            response = self.get_response(request)
+
+        response['X-Query-Count'] = str(recorder.count)
+        problems = check_queries(request, recorder)
+        if problems:
+            message = f'{request.method} {request.get_full_path()}: ' + '; '.join(problems)
+            if getattr(settings, 'STORE_QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,113 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from .cache import get_cache
+
+
+PIN_COOKIE = 'replica_pin'
+SAFE_METHODS = ('GET', 'HEAD')
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def get_replicas():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+def _pin_seconds():
+    return getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+
+@contextmanager
+def reading_from_primary():
+    """
+    Sends the reads inside the block to the primary. Used around reads whose
+    result gets cached: a replica still behind a write would otherwise have
+    its stale rows cached under the namespace version that write bumped.
+    """
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to a replica while ReplicaMiddleware allows it for the
+    current request; everything else goes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if replicas and _use_replica.get():
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+
+def _pin_key(request):
+    # JWT clients often don't keep cookies, so they are pinned by their
+    # token instead.
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if authorization:
+        digest = hashlib.sha256(authorization.encode()).hexdigest()
+        return f'store:replica_pin:{digest}'
+    return None
+
+
+def is_pinned(request):
+    if PIN_COOKIE in request.COOKIES:
+        return True
+    key = _pin_key(request)
+    return key is not None and get_cache().get(key) is not None
+
+
+def pin(request, response):
+    """
+    Keeps a client that just wrote on the primary until the replicas have
+    had time to catch up, so it reads its own writes.
+    """
+    response.set_cookie(PIN_COOKIE, '1', max_age=_pin_seconds(), httponly=True, samesite='Lax')
+    key = _pin_key(request)
+    if key is not None:
+        get_cache().set(key, True, timeout=_pin_seconds())
+
+
+class ReplicaMiddleware:
+    """
+    Lets GET/HEAD requests to viewsets with `read_from_replica = True` read
+    from a replica, unless the client wrote something in the last
+    REPLICA_PIN_SECONDS. Reads that fill a cache still go to the primary.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            token = getattr(request, '_replica_token', None)
+            if token is not None:
+                _use_replica.reset(token)
+
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            pin(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in SAFE_METHODS or not get_replicas():
+            return None
+        view_class = getattr(view_func, 'cls', None)
+        if getattr(view_class, 'read_from_replica', False) and not is_pinned(request):
+            request._replica_token = _use_replica.set(True)
+        return None
@@ -0,0 +1,205 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, FloatField, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from .cache import bump_namespace, get_local_namespace_version, reading_from_primary
+
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Bumped by every change to indexed text: product titles and descriptions,
+# new and deleted products. Other writes, like inventory, leave it alone.
+INDEX_NAMESPACE = 'search_index'
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+class SearchBackend:
+    """
+    Ranks products for a search term. `search` returns the queryset narrowed
+    to matching products and annotated with a `search_rank` (higher is
+    better), so it composes with ProductFilter, ordering and pagination.
+    """
+
+    def search(self, queryset, term):
+        raise NotImplementedError
+
+    def index_product(self, product):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+    def invalidate(self):
+        """
+        Called after writes that skip the Product signals but may change
+        indexed text, such as QuerySet.update() and raw inserts.
+        """
+        pass
+
+
+class MySQLFullTextBackend(SearchBackend):
+    """
+    Uses the FULLTEXT index on (title, description) added in migration 0016.
+    MySQL's natural language mode already returns a BM25-style relevance.
+    """
+    match = 'MATCH (store_product.title, store_product.description) AGAINST (%s IN NATURAL LANGUAGE MODE)'
+
+    def search(self, queryset, term):
+        return queryset \
+            .annotate(search_rank=RawSQL(self.match, [term], output_field=FloatField())) \
+            .filter(search_rank__gt=0)
+
+
+class InvertedIndexBackend(SearchBackend):
+    """
+    In-process inverted index scored with Okapi BM25, meant for development,
+    tests and SQLite. It is built lazily from the product table and kept
+    current by this process's Product signals. Each change to indexed text
+    also bumps INDEX_NAMESPACE, which makes the next search in every other
+    process rebuild its copy.
+
+    Only the STORE_SEARCH_MAX_RESULTS (default 1000) best matches are
+    returned, so a very broad term does not turn into an IN list of the
+    whole catalog.
+    """
+    k1 = 1.2
+    b = 0.75
+    title_boost = 2
+
+    def __init__(self):
+        self.max_results = getattr(settings, 'STORE_SEARCH_MAX_RESULTS', 1000)
+        self._lock = threading.RLock()
+        self._built = False
+        self._version = None
+        self._postings = {}
+        self._documents = {}
+        self._lengths = {}
+        self._total_length = 0
+
+    def rebuild(self):
+        from store.models import Product
+
+        with self._lock:
+            # Taken first, so a write that lands mid-build triggers another.
+            self._version = get_local_namespace_version(INDEX_NAMESPACE)
+            self._postings = {}
+            self._documents = {}
+            self._lengths = {}
+            self._total_length = 0
+            # A lagging replica would leave out the very write that
+            # triggered the rebuild, until the next one.
+            with reading_from_primary():
+                products = Product.objects \
+                    .values_list('id', 'title', 'description') \
+                    .iterator()
+                for product_id, title, description in products:
+                    self._add(product_id, title, description)
+            self._built = True
+
+    def index_product(self, product):
+        with self._lock:
+            if self._built:
+                self._remove(product.id)
+                self._add(product.id, product.title, product.description)
+            self._publish()
+
+    def remove_product(self, product_id):
+        with self._lock:
+            if self._built:
+                self._remove(product_id)
+            self._publish()
+
+    def invalidate(self):
+        bump_namespace(INDEX_NAMESPACE)
+
+    def _publish(self):
+        # This process already applied the change; it only rebuilds too if
+        # another write bumped the version since its last build.
+        version = bump_namespace(INDEX_NAMESPACE)
+        if self._built and version == self._version + 1:
+            self._version = version
+
+    def search(self, queryset, term):
+        scores = self.score(term)
+        if not scores:
+            return queryset \
+                .annotate(search_rank=Value(0.0, output_field=FloatField())) \
+                .none()
+
+        return queryset \
+            .filter(id__in=scores.keys()) \
+            .annotate(search_rank=Case(
+                *[When(id=product_id, then=Value(score))
+                  for product_id, score in scores.items()],
+                output_field=FloatField()))
+
+    def score(self, term):
+        with self._lock:
+            if not self._built or self._version != get_local_namespace_version(INDEX_NAMESPACE):
+                self.rebuild()
+
+            document_count = len(self._documents)
+            if document_count == 0:
+                return {}
+            average_length = self._total_length / document_count
+
+            scores = Counter()
+            for token in set(tokenize(term)):
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for product_id, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[product_id] / average_length)
+                    scores[product_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return dict(heapq.nlargest(self.max_results, scores.items(), key=lambda item: item[1]))
+
+    def _add(self, product_id, title, description):
+        terms = Counter(tokenize(description))
+        for token in tokenize(title):
+            terms[token] += self.title_boost
+        self._documents[product_id] = terms
+        self._lengths[product_id] = sum(terms.values())
+        self._total_length += self._lengths[product_id]
+        for token, frequency in terms.items():
+            self._postings.setdefault(token, {})[product_id] = frequency
+
+    def _remove(self, product_id):
+        terms = self._documents.pop(product_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._lengths.pop(product_id)
+        for token in terms:
+            postings = self._postings[token]
+            del postings[product_id]
+            if not postings:
+                del self._postings[token]
+
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    Returns the backend named by the STORE_SEARCH_BACKEND setting, falling
+    back to FULLTEXT on MySQL and the in-process index elsewhere.
+    """
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'STORE_SEARCH_BACKEND', None)
+        if path is None:
+            backend_class = MySQLFullTextBackend if connection.vendor == 'mysql' else InvertedIndexBackend
+        else:
+            backend_class = import_string(path)
+        _backend = backend_class()
+    return _backend
@@ -1,8 +1,7 @@
 from decimal import Decimal
 from django.db import transaction
 from rest_framework import serializers
-from .signals import order_created
-from .models import Cart, CartItem, Customer, Order, OrderItem, Product, Collection, Review, ProductImage
+from .models import Cart, CartItem, Customer, Job, Order, OrderItem, Product, Collection, Promotion, Review, ProductImage
 
 
 class CollectionSerializer(serializers.ModelSerializer):
@@ -21,12 +20,56 @@ class ProductImageSerializer(serializers.ModelSerializer):
         product_id = self.context['product_id']
         return ProductImage.objects.create(product_id=product_id, **validated_data)
 
-class ProductSerializer(serializers.ModelSerializer):
+class PromotionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Promotion
+        fields = ['id', 'description', 'discount']
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    Takes an optional `fields` argument listing which of its fields to
+    return, and an `expand` argument naming relations from
+    Meta.expandable_fields to inline as nested objects.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = expand or []
+        for name in expand:
+            serializer_class, options = self.Meta.expandable_fields[name]
+            self.fields[name] = serializer_class(read_only=True, **options)
+        if fields is not None:
+            for name in set(self.fields) - set(fields) - set(expand):
+                self.fields.pop(name)
+
+    @classmethod
+    def get_prefetch_plan(cls, relations):
+        """
+        Splits relations into (select_related, prefetch_related) names:
+        forward foreign keys are joined, everything else is prefetched.
+        """
+        select, prefetch = [], []
+        for name in relations:
+            field = cls.Meta.model._meta.get_field(name)
+            if field.concrete and (field.many_to_one or field.one_to_one):
+                select.append(name)
+            else:
+                prefetch.append(name)
+        return select, prefetch
+
+
+class ProductSerializer(DynamicFieldsModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     class Meta:
         model = Product
         fields = ['id', 'title', 'description', 'slug', 'inventory',
                   'unit_price', 'price_with_tax', 'collection', 'images']
+        expandable_fields = {
+            'collection': (CollectionSerializer, {}),
+            'promotions': (PromotionSerializer, {'many': True}),
+            'images': (ProductImageSerializer, {'many': True}),
+        }
 
     price_with_tax = serializers.SerializerMethodField(
         method_name='calculate_tax')
@@ -35,6 +78,61 @@ class ProductSerializer(serializers.ModelSerializer):
         return product.unit_price * Decimal(1.1)
 
 
+class ProductValuesSerializer:
+    """
+    A read-only stand-in for ProductSerializer(many=True) that builds the
+    same dicts, in the same field order, from values() rows: no model
+    instances and no per-field to_representation calls. Anything it can't
+    build (expansions) is left to ProductSerializer.
+    """
+    columns = ['id', 'title', 'description', 'slug', 'inventory', 'unit_price', 'collection']
+    # Always read: what KeysetPagination may need to build a cursor.
+    position_columns = ['id', 'title', 'unit_price', 'last_update']
+    # The same constant as calculate_tax, so prices match to the last digit.
+    tax_rate = Decimal(1.1)
+
+    def __init__(self, fields=None, context=None):
+        self.fields = [name for name in ProductSerializer.Meta.fields
+                       if fields is None or name in fields]
+        self.context = context or {}
+
+    def get_rows(self, queryset):
+        columns = {name for name in self.fields if name in self.columns}
+        columns.update(self.position_columns)
+        if 'search_rank' in queryset.query.annotations:
+            columns.add('search_rank')
+        return queryset.prefetch_related(None).values(*columns)
+
+    def get_images(self, product_ids):
+        storage = ProductImage._meta.get_field('image').storage
+        request = self.context.get('request')
+        images = {}
+        rows = ProductImage.objects \
+            .filter(product_id__in=product_ids) \
+            .values_list('id', 'product_id', 'image')
+        for image_id, product_id, name in rows:
+            url = None
+            if name:
+                url = storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+            images.setdefault(product_id, []).append({'id': image_id, 'image': url})
+        return images
+
+    def to_representation(self, rows):
+        fields = self.fields
+        with_tax = 'price_with_tax' in fields
+        images = self.get_images([row['id'] for row in rows]) if 'images' in fields else None
+        data = []
+        for row in rows:
+            if with_tax:
+                row['price_with_tax'] = row['unit_price'] * self.tax_rate
+            if images is not None:
+                row['images'] = images.get(row['id'], [])
+            data.append({name: row[name] for name in fields})
+        return data
+
+
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
@@ -53,10 +151,9 @@ class SimpleProductSerializer(serializers.ModelSerializer):
 
 class CartItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
-    total_price = serializers.SerializerMethodField()
-
-    def get_total_price(self, cart_item: CartItem):
-        return cart_item.quantity * cart_item.product.unit_price
+    # Annotated by CartItem.objects.with_total_price()
+    total_price = serializers.DecimalField(
+        max_digits=12, decimal_places=2, read_only=True)
 
     class Meta:
         model = CartItem
@@ -66,10 +163,14 @@ class CartItemSerializer(serializers.ModelSerializer):
 class CartSerializer(serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     items = CartItemSerializer(many=True, read_only=True)
-    total_price = serializers.SerializerMethodField()
+    # Annotated in SQL by CartViewSet.queryset
+    total_price = serializers.DecimalField(
+        max_digits=12, decimal_places=2, read_only=True)
 
-    def get_total_price(self, cart):
-        return sum([item.quantity * item.product.unit_price for item in cart.items.all()])
+    def create(self, validated_data):
+        cart = super().create(validated_data)
+        cart.total_price = Decimal(0)
+        return cart
 
     class Meta:
         model = Cart
@@ -79,26 +180,15 @@ class CartSerializer(serializers.ModelSerializer):
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(
-                'No product with the given ID was found.')
-        return value
-
     def save(self, **kwargs):
         cart_id = self.context['cart_id']
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
 
-        try:
-            cart_item = CartItem.objects.get(
-                cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data)
+        self.instance = CartItem.objects.add(cart_id, product_id, quantity)
+        if self.instance is None:
+            raise serializers.ValidationError(
+                {'product_id': ['No product with the given ID was found.']})
 
         return self.instance
 
@@ -158,13 +248,18 @@ class CreateOrderSerializer(serializers.Serializer):
         with transaction.atomic():
             cart_id = self.validated_data['cart_id']
 
-            customer = Customer.objects.get(
-                user_id=self.context['user_id'])
-            order = Order.objects.create(customer=customer)
+            cart_items = list(CartItem.objects
+                              .select_related('product')
+                              .filter(cart_id=cart_id))
+            short = Product.objects.decrement_inventory(
+                {item.product_id: item.quantity for item in cart_items})
+            if short:
+                raise serializers.ValidationError(
+                    {'cart_id': [f'Not enough inventory for product(s) {sorted(short)}.']})
+
+            order = Order.objects.create(
+                customer_id=self.context['customer_id'])
 
-            cart_items = CartItem.objects \
-                .select_related('product') \
-                .filter(cart_id=cart_id)
             order_items = [
                 OrderItem(
                     order=order,
@@ -177,6 +272,7 @@ class CreateOrderSerializer(serializers.Serializer):
 
             Cart.objects.filter(pk=cart_id).delete()
 
-            order_created.send_robust(self.__class__, order=order)
+            # Receivers run in the run_jobs worker, after this commits.
+            Job.objects.enqueue('order_created', order_id=order.id)
 
             return order
@@ -1,9 +1,102 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
 from django.dispatch import receiver
-from store.models import Customer
+from store.cache import CATALOG, COLLECTIONS, COLLECTIONS_MARKER, CUSTOMERS, PRODUCT_IMAGES_MARKER, PRODUCTS_MARKER, bump_namespace, touch_marker
+from store.models import Collection, Customer, Product, ProductImage, Promotion
+from store.search import get_search_backend
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
   if kwargs['created']:
-    Customer.objects.create(user=kwargs['instance'])
\ No newline at end of file
+    Customer.objects.create(user=kwargs['instance'])
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, **kwargs):
+  product = kwargs['instance']
+  # Deferred fields are neither read here nor saved.
+  text = (product.__dict__.get('title'), product.__dict__.get('description'))
+  if not kwargs['created'] and text == product._loaded_search_text:
+    return
+  product._loaded_search_text = text
+  transaction.on_commit(lambda: get_search_backend().index_product(product))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, **kwargs):
+  product_id = kwargs['instance'].id
+  transaction.on_commit(lambda: get_search_backend().remove_product(product_id))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def invalidate_catalog_cache(sender, **kwargs):
+  transaction.on_commit(lambda: bump_namespace(CATALOG))
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+@receiver(m2m_changed, sender=Product.promotions.through)
+def invalidate_promotions(sender, **kwargs):
+  # Promotions are inlined by ?expand=promotions and carry no timestamp.
+  if kwargs.get('action', 'post_').startswith('post_'):
+    transaction.on_commit(lambda: bump_namespace(CATALOG))
+    transaction.on_commit(lambda: touch_marker(PRODUCTS_MARKER))
+
+
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def invalidate_collections_cache(sender, **kwargs):
+  transaction.on_commit(lambda: bump_namespace(COLLECTIONS))
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_customer_cache(sender, **kwargs):
+  transaction.on_commit(lambda: bump_namespace(CUSTOMERS))
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def touch_change_marker(sender, **kwargs):
+  # Saved products already move last_update; everything else needs a marker.
+  marker = {
+    Product: PRODUCTS_MARKER,
+    ProductImage: PRODUCT_IMAGES_MARKER,
+    Collection: COLLECTIONS_MARKER,
+  }[sender]
+  transaction.on_commit(lambda: touch_marker(marker))
+
+
+@receiver(post_init, sender=Product)
+def remember_loaded_values(sender, **kwargs):
+  instance = kwargs['instance']
+  # Read __dict__ directly so a deferred collection_id isn't fetched.
+  instance._loaded_collection_id = instance.__dict__.get('collection_id')
+  instance._loaded_search_text = (instance.__dict__.get('title'), instance.__dict__.get('description'))
+
+
+@receiver(post_save, sender=Product)
+def update_products_count_on_save(sender, **kwargs):
+  product = kwargs['instance']
+  if kwargs['created']:
+    deltas = {product.collection_id: 1}
+  elif product._loaded_collection_id not in (None, product.collection_id):
+    deltas = {product._loaded_collection_id: -1, product.collection_id: 1}
+  else:
+    return
+  Collection.objects.adjust_products_count(deltas)
+  product._loaded_collection_id = product.collection_id
+
+
+@receiver(post_delete, sender=Product)
+def update_products_count_on_delete(sender, **kwargs):
+  Collection.objects.adjust_products_count({kwargs['instance'].collection_id: -1})
@@ -1,3 +1,1006 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+from django.core.cache import caches
+from django.core.management import call_command
+from datetime import timedelta
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+from core.authentication import user_cache
+from core.models import User
+from core.serializers import TokenObtainPairSerializer
+from store import cache
+from store.cache import CATALOG, PRODUCTS_MARKER, customer_cache, get_marker, get_namespace_version, product_cache
+from store.management.commands.seed_db import read_rows
+from store.models import Cart, CartItem, Collection, Job, Order, OrderItem, Product, ProductImage, Promotion, Review
+from store.profiling import assert_queries_within
+from store import jobs
+from store.views import CollectionViewSet, ProductViewSet
+from store.replicas import PIN_COOKIE, ReplicaRouter, _use_replica
+from store import search
+from store.signals import order_created
+from store.search import InvertedIndexBackend, get_search_backend
 
-# Create your tests here.
+
+class QueryBudgetTests(TestCase):
+    """
+    Drives every endpoint with cold caches, user_cache included, and holds
+    it to the query_budget of its viewset.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title='Collection')
+        promotions = Promotion.objects.bulk_create(
+            [Promotion(description=f'Promotion {i}', discount=0.1) for i in range(2)])
+        cls.products = []
+        for i in range(5):
+            product = Product.objects.create(
+                title=f'Product {i}', slug=f'product-{i}', unit_price=10 + i, inventory=10,
+                collection=cls.collection)
+            product.promotions.set(promotions)
+            ProductImage.objects.create(product=product, image=f'store/images/{i}.png')
+            Review.objects.create(product=product, name='Reviewer', description='Good')
+            cls.products.append(product)
+        cls.product = cls.products[0]
+        cls.review = cls.product.reviews.first()
+        cls.image = cls.product.images.first()
+
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'secret', is_staff=True)
+        cls.customer = cls.staff.customer
+        cls.cart = Cart.objects.create()
+        cls.cart_items = [CartItem.objects.create(cart=cls.cart, product=product, quantity=1)
+                          for product in cls.products]
+        cls.order = Order.objects.create(customer=cls.customer)
+        for product in cls.products:
+            OrderItem.objects.create(order=cls.order, product=product, quantity=1, unit_price=product.unit_price)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def authenticate(self):
+        token = TokenObtainPairSerializer.get_token(self.staff).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+
+    def request(self, method, url, data=None):
+        caches['default'].clear()
+        product_cache.local.clear()
+        customer_cache.local.clear()
+        user_cache.clear()
+        match = resolve(url.split('?')[0])
+        action = match.func.actions[method]
+        budget = match.func.cls.query_budget[action]
+        with assert_queries_within(budget):
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300, response.content)
+        return response
+
+    def test_products(self):
+        product = self.product.id
+        collection = self.collection.id
+        self.request('get', '/store/products/')
+        self.request('get', f'/store/products/?collection_id={collection}')
+        self.request('get', '/store/products/?expand=collection,promotions')
+        self.request('get', f'/store/products/?collection_id={collection}&expand=collection,promotions')
+        self.request('get', '/store/products/?fields=id,title&search=product')
+        self.request('get', '/store/products/?ordering=-unit_price')
+        self.request('get', f'/store/products/{product}/')
+        self.request('get', f'/store/products/{product}/?expand=collection,promotions')
+
+    def test_authenticated_products(self):
+        self.authenticate()
+        self.request('get', f'/store/products/?collection_id={self.collection.id}&expand=collection,promotions')
+        self.request('get', f'/store/products/{self.product.id}/?expand=collection,promotions')
+
+    def test_collections(self):
+        self.request('get', '/store/collections/')
+        self.request('get', f'/store/collections/{self.collection.id}/')
+
+    def test_reviews(self):
+        self.request('get', f'/store/products/{self.product.id}/reviews/')
+        self.request('get', f'/store/products/{self.product.id}/reviews/{self.review.id}/')
+
+    def test_product_images(self):
+        self.request('get', f'/store/products/{self.product.id}/images/')
+        self.request('get', f'/store/products/{self.product.id}/images/{self.image.id}/')
+
+    def test_carts(self):
+        self.request('get', f'/store/carts/{self.cart.id}/')
+        self.request('get', f'/store/carts/{self.cart.id}/items/')
+        self.request('get', f'/store/carts/{self.cart.id}/items/{self.cart_items[0].id}/')
+        self.request('post', f'/store/carts/{self.cart.id}/items/',
+                     {'product_id': self.product.id, 'quantity': 1})
+
+    def test_customers(self):
+        self.authenticate()
+        self.request('get', '/store/customers/')
+        self.request('get', f'/store/customers/{self.customer.id}/')
+        self.request('get', '/store/customers/me/')
+
+    def test_orders(self):
+        self.authenticate()
+        self.request('get', '/store/orders/')
+        self.request('get', f'/store/orders/{self.order.id}/')
+
+
+class ReadRowsTests(SimpleTestCase):
+    data = 'id,title,description\r\n1,One,"first\nline, with comma"\r\n\r\n2,Two,\r\n3,"Three ""quoted""",x\r\n'.encode()
+
+    def test_quoted_newlines_stay_in_one_record(self):
+        columns, rows = read_rows(io.BytesIO(self.data), 'csv')
+        self.assertEqual(columns, ['id', 'title', 'description'])
+        self.assertEqual([row for row, _ in rows], [
+            ['1', 'One', 'first\nline, with comma'],
+            ['2', 'Two', None],
+            ['3', 'Three "quoted"', 'x'],
+        ])
+
+    def test_offsets_resume_at_record_boundaries(self):
+        _, rows = read_rows(io.BytesIO(self.data), 'csv')
+        (_, offset), *rest = rows
+        _, resumed = read_rows(io.BytesIO(self.data), 'csv', offset)
+        self.assertEqual(list(resumed), rest)
+
+
+class ProductQuerySetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title='Collection')
+
+    def assertInvalidatesCatalog(self, write):
+        version, marker = get_namespace_version(CATALOG), get_marker(PRODUCTS_MARKER)
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        self.assertNotEqual(get_namespace_version(CATALOG), version)
+        self.assertNotEqual(get_marker(PRODUCTS_MARKER), marker)
+
+    def test_bulk_paths_invalidate_the_catalog(self):
+        self.assertInvalidatesCatalog(lambda: Product.objects.bulk_create([Product(
+            title='Product', slug='product', unit_price=10, inventory=5, collection=self.collection)]))
+        self.assertInvalidatesCatalog(lambda: Product.objects.update(inventory=3))
+        other = Collection.objects.create(title='Other')
+        self.assertInvalidatesCatalog(lambda: Product.objects.update(collection=other))
+
+    def test_counter_drift_does_not_fail_deletes(self):
+        product = Product.objects.create(
+            title='Product', slug='product', unit_price=10, inventory=5, collection=self.collection)
+        Collection.objects.update(products_count=0)
+        product.delete()
+        self.collection.refresh_from_db()
+        self.assertEqual(self.collection.products_count, 0)
+
+
+class InvertedIndexBackendTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        Product.objects.bulk_create([
+            Product(title=f'Coffee {i}', slug=f'coffee-{i}', unit_price=10, inventory=5, collection=collection)
+            for i in range(5)])
+
+    def test_rebuilds_after_writes_that_skip_signals(self):
+        backend = InvertedIndexBackend()
+        self.assertEqual(len(backend.score('coffee')), 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.update(title='Tea')
+        self.assertEqual(backend.score('coffee'), {})
+        self.assertEqual(len(backend.score('tea')), 5)
+
+    def test_saves_update_this_process_without_a_rebuild(self):
+        search._backend = None
+        backend = get_search_backend()
+        backend.score('coffee')
+        product = Product.objects.first()
+        with mock.patch.object(backend, 'rebuild', wraps=backend.rebuild) as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                product.inventory = 1
+                product.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                product.title = 'Espresso'
+                product.save()
+            self.assertEqual(list(backend.score('espresso')), [product.id])
+        rebuild.assert_not_called()
+
+    def test_other_processes_rebuild_after_text_changes(self):
+        other = InvertedIndexBackend()
+        other.score('coffee')
+        product = Product.objects.first()
+        with mock.patch.object(other, 'rebuild', wraps=other.rebuild) as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                product.inventory = 1
+                product.save()
+            other.score('coffee')
+            rebuild.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                product.title = 'Espresso'
+                product.save()
+            self.assertEqual(list(other.score('espresso')), [product.id])
+        rebuild.assert_called_once()
+
+    @override_settings(STORE_SEARCH_MAX_RESULTS=2)
+    def test_keeps_the_best_max_results(self):
+        self.assertEqual(len(InvertedIndexBackend().score('coffee')), 2)
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        cls.plenty, cls.scarce = Product.objects.bulk_create([
+            Product(title=title, slug=title.lower(), unit_price=10, inventory=inventory, collection=collection)
+            for title, inventory in [('Plenty', 5), ('Scarce', 1)]])
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret')
+
+    def setUp(self):
+        self.client = APIClient()
+        token = TokenObtainPairSerializer.get_token(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+        self.cart = Cart.objects.create()
+
+    def add(self, product_id, quantity):
+        return self.client.post(f'/store/carts/{self.cart.id}/items/',
+                                {'product_id': product_id, 'quantity': quantity}, format='json')
+
+    def checkout(self):
+        return self.client.post('/store/orders/', {'cart_id': str(self.cart.id)}, format='json')
+
+    def inventory(self):
+        return dict(Product.objects.values_list('id', 'inventory'))
+
+    def test_repeated_add_increments_the_quantity(self):
+        self.assertEqual(self.add(self.plenty.id, 2).status_code, 201)
+        response = self.add(self.plenty.id, 3)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['quantity'], 5)
+        self.assertEqual(list(self.cart.items.values_list('product_id', 'quantity')), [(self.plenty.id, 5)])
+
+    def test_adding_an_unknown_product_is_rejected(self):
+        response = self.add(999, 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product_id', response.data)
+        self.assertFalse(self.cart.items.exists())
+
+    def test_checkout_takes_the_cart_off_inventory(self):
+        self.add(self.plenty.id, 2)
+        self.add(self.scarce.id, 1)
+        version = get_namespace_version(CATALOG)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.checkout()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.inventory(), {self.plenty.id: 3, self.scarce.id: 0})
+        self.assertNotEqual(get_namespace_version(CATALOG), version)
+        self.assertEqual(len(response.data['items']), 2)
+        self.assertFalse(Cart.objects.filter(pk=self.cart.id).exists())
+
+    def test_short_line_rolls_back_the_whole_order(self):
+        self.add(self.plenty.id, 2)
+        self.add(self.scarce.id, 2)
+        before = self.inventory()
+        response = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['cart_id'], [f'Not enough inventory for product(s) [{self.scarce.id}].'])
+        self.assertEqual(self.inventory(), before)
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(Cart.objects.filter(pk=self.cart.id).exists())
+
+    def test_last_unit_is_not_sold_twice(self):
+        self.add(self.scarce.id, 1)
+        self.assertEqual(self.checkout().status_code, 200)
+        self.cart = Cart.objects.create()
+        self.add(self.scarce.id, 1)
+        self.assertEqual(self.checkout().status_code, 400)
+        self.assertEqual(self.inventory()[self.scarce.id], 0)
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Walks the product list forward and back for every ordering. Prices and
+    titles repeat, so the id tiebreaker decides the order of many rows.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        for i in range(25):
+            Product.objects.create(
+                title=['Coffee beans', 'Coffee mug', 'Tea'][i % 3], slug=f'product-{i}',
+                description='coffee ' * (i % 4), unit_price=[10, 20, 30][i % 3] + i % 2,
+                inventory=5, collection=collection)
+
+    def setUp(self):
+        caches['default'].clear()
+        search._backend = None
+        self.client = APIClient()
+
+    def walk(self, url, link):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([product['id'] for product in response.data['results']])
+            url = response.data[link]
+        return pages
+
+    def assert_pages(self, query, expected):
+        pages = self.walk(f'/store/products/?{query}', 'next')
+        self.assertEqual(pages, [expected[i:i + 10] for i in range(0, len(expected), 10)])
+
+        # Back from the last page through every previous link.
+        response = self.client.get(f'/store/products/?{query}')
+        for _ in pages[1:]:
+            response = self.client.get(response.data['next'])
+        backward = self.walk(response.data['previous'], 'previous')
+        self.assertEqual(backward, pages[-2::-1])
+
+    def test_every_ordering(self):
+        for ordering, order_by in [
+            ('', ['title', 'id']),
+            ('ordering=unit_price', ['unit_price', 'id']),
+            ('ordering=-unit_price', ['-unit_price', '-id']),
+            ('ordering=last_update', ['last_update', 'id']),
+            ('ordering=-last_update', ['-last_update', '-id']),
+        ]:
+            with self.subTest(ordering=ordering):
+                expected = list(Product.objects.order_by(*order_by).values_list('id', flat=True))
+                self.assert_pages(ordering, expected)
+
+    def test_search_rank(self):
+        queryset = get_search_backend().search(Product.objects.all(), 'coffee')
+        expected = list(queryset.order_by('-search_rank', '-id').values_list('id', flat=True))
+        self.assertEqual(len(expected), 23)
+        self.assert_pages('search=coffee', expected)
+
+    def test_filters_apply_on_every_page(self):
+        expected = list(Product.objects.filter(unit_price__gt=15).order_by('title', 'id')
+                        .values_list('id', flat=True))
+        pages = self.walk('/store/products/?unit_price__gt=15', 'next')
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/store/products/?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductQueryParamTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title='Collection')
+        cls.promotion = Promotion.objects.create(description='Promotion', discount=0.1)
+        cls.products = []
+        for i in range(3):
+            product = Product.objects.create(
+                title=f'Product {i}', slug=f'product-{i}', description='Long text',
+                unit_price=10 + i, inventory=10, collection=cls.collection)
+            product.promotions.add(cls.promotion)
+            ProductImage.objects.create(product=product, image=f'store/images/{i}.jpg')
+            cls.products.append(product)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def get(self, url):
+        """
+        Returns the response to a cold-cache GET and the SQL it ran.
+        """
+        caches['default'].clear()
+        product_cache.local.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        return response, [query['sql'] for query in context.captured_queries]
+
+    def list_url(self, query):
+        return f'/store/products/?{query}'
+
+    def detail_url(self, query):
+        return f'/store/products/{self.products[0].id}/?{query}'
+
+    def urls(self, query):
+        return [self.list_url(query), self.detail_url(query)]
+
+    def first(self, response):
+        return response.data['results'][0] if 'results' in response.data else response.data
+
+    def product_selects(self, queries):
+        table = Product._meta.db_table
+        # Leaves out the MAX(last_update) behind the ETag.
+        return [sql for sql in queries
+                if sql.startswith('SELECT') and f'FROM "{table}"' in sql and 'MAX(' not in sql]
+
+
+class SparseFieldsetTests(ProductQueryParamTestCase):
+    def test_returns_only_the_requested_fields(self):
+        for url in self.urls('fields=id,title,unit_price'):
+            response, _ = self.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(list(self.first(response)), ['id', 'title', 'unit_price'], url)
+
+    def test_unknown_fields_are_rejected(self):
+        for url in self.urls('fields=id,secret'):
+            response, _ = self.get(url)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertEqual(response.data, {'fields': ['Unknown field(s): secret.']}, url)
+
+    def test_images_are_only_read_when_requested(self):
+        table = ProductImage._meta.db_table
+        for url in self.urls('fields=id,title'):
+            _, queries = self.get(url)
+            self.assertFalse([sql for sql in queries if f'"{table}"' in sql], url)
+        for url in self.urls('fields=id,images'):
+            response, queries = self.get(url)
+            self.assertEqual(len([sql for sql in queries if f'"{table}"' in sql]), 1, url)
+            self.assertEqual(len(self.first(response)['images']), 1, url)
+
+    def test_unrequested_columns_are_not_read(self):
+        for url in self.urls('fields=id,title'):
+            _, queries = self.get(url)
+            for sql in self.product_selects(queries):
+                self.assertNotIn('"description"', sql, url)
+
+    def test_only_loads_what_an_expansion_needs(self):
+        response, queries = self.get(self.detail_url('fields=id&expand=collection'))
+        self.assertEqual(response.data, {
+            'id': self.products[0].id,
+            'collection': {'id': self.collection.id, 'title': 'Collection', 'products_count': 3},
+        })
+        [select] = self.product_selects(queries)
+        self.assertNotIn('"description"', select)
+
+        # A deferred column read per row would add a query per product.
+        _, queries = self.get(self.list_url('fields=id,price_with_tax&expand=collection,promotions'))
+        Product.objects.create(
+            title='Product 3', slug='product-3', unit_price=13, inventory=10, collection=self.collection)
+        _, more_queries = self.get(self.list_url('fields=id,price_with_tax&expand=collection,promotions'))
+        self.assertEqual(len(more_queries), len(queries))
+
+
+class ExpandTests(ProductQueryParamTestCase):
+    def test_inlines_the_requested_relations(self):
+        for url in self.urls('expand=collection,promotions'):
+            response, _ = self.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            product = self.first(response)
+            self.assertEqual(product['collection'],
+                             {'id': self.collection.id, 'title': 'Collection', 'products_count': 3}, url)
+            self.assertEqual(product['promotions'],
+                             [{'id': self.promotion.id, 'description': 'Promotion', 'discount': 0.1}], url)
+
+    def test_relations_stay_ids_unless_expanded(self):
+        for url in self.urls(''):
+            response, _ = self.get(url)
+            product = self.first(response)
+            self.assertEqual(product['collection'], self.collection.id, url)
+            self.assertNotIn('promotions', product, url)
+
+    def test_unknown_expansions_are_rejected(self):
+        for url in self.urls('expand=collection,customer'):
+            response, _ = self.get(url)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertEqual(response.data, {'expand': ['Unknown field(s): customer.']}, url)
+
+    def test_collection_is_joined_and_promotions_prefetched(self):
+        collections = Collection._meta.db_table
+        promotions = Promotion._meta.db_table
+        for url in self.urls('expand=collection,promotions'):
+            _, queries = self.get(url)
+            self.assertFalse([sql for sql in queries if f'FROM "{collections}"' in sql], url)
+            self.assertEqual(len([sql for sql in queries if f'FROM "{promotions}"' in sql]), 1, url)
+            [select] = self.product_selects(queries)
+            self.assertIn(f'JOIN "{collections}"', select, url)
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        url = self.list_url('expand=collection,promotions,images')
+        _, queries = self.get(url)
+        for i in range(3, 6):
+            product = Product.objects.create(
+                title=f'Product {i}', slug=f'product-{i}', unit_price=10, inventory=10,
+                collection=self.collection)
+            product.promotions.add(self.promotion)
+        response, more_queries = self.get(url)
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(len(more_queries), len(queries))
+
+    def test_promotion_changes_invalidate_expanded_responses(self):
+        url = self.detail_url('expand=promotions')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].promotions.clear()
+        self.assertEqual(self.client.get(url).data['promotions'], [])
+
+
+class ProductValuesSerializerTests(ProductQueryParamTestCase):
+    """
+    The values() fast path must render the same bytes as ProductSerializer.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i in range(3, 15):
+            Product.objects.create(
+                title=f'Product {i % 5}', slug=f'product-{i}', description=f'Coffee {"beans " * (i % 3)}',
+                unit_price=f'{10 + i % 4}.{i}', inventory=i, collection=cls.collection)
+
+    def get_both(self, url):
+        fast, _ = self.get(url)
+        with mock.patch.object(ProductViewSet, 'values_serializer_class', None):
+            slow, _ = self.get(url)
+        self.assertEqual(fast.status_code, 200, url)
+        return fast, slow
+
+    def assert_same_pages(self, query):
+        url = self.list_url(query)
+        while url:
+            fast, slow = self.get_both(url)
+            self.assertEqual(fast.content, slow.content, url)
+            url = fast.data['next']
+
+    def test_default_list(self):
+        self.assert_same_pages('')
+
+    def test_sparse_fieldsets(self):
+        for fields in ['id,title,unit_price', 'price_with_tax,images', 'collection,description']:
+            with self.subTest(fields=fields):
+                self.assert_same_pages(f'fields={fields}')
+
+    def test_search(self):
+        self.assert_same_pages('search=coffee')
+        self.assert_same_pages('search=coffee&fields=id,title')
+
+    def test_ordering(self):
+        self.assert_same_pages('ordering=-unit_price')
+
+    def test_next_page_cursor(self):
+        fast, slow = self.get_both(self.list_url('ordering=unit_price'))
+        self.assertIsNotNone(fast.data['next'])
+        self.assertEqual(fast.data['next'], slow.data['next'])
+        fast, slow = self.get_both(fast.data['next'])
+        self.assertEqual(fast.data['previous'], slow.data['previous'])
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        # Jobs enqueued during the test default to the real clock.
+        self.now = timezone.now() + timedelta(seconds=1)
+        patcher = mock.patch('store.jobs.timezone.now', return_value=self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.failing = mock.Mock(side_effect=RuntimeError('boom'))
+        patcher = mock.patch.dict(jobs.handlers, {'failing': self.failing})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def claimed_ids(self, limit=10):
+        return sorted(jobs.claim_jobs(limit).values_list('id', flat=True))
+
+    def test_job_is_only_enqueued_if_the_transaction_commits(self):
+        try:
+            with transaction.atomic():
+                Job.objects.enqueue('order_created', order_id=1)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(Job.objects.exists())
+
+        with transaction.atomic():
+            job = Job.objects.enqueue('order_created', order_id=1)
+        self.assertEqual(self.claimed_ids(), [job.id])
+
+    def test_claims_are_exclusive(self):
+        first, second = [Job.objects.enqueue('failing') for _ in range(2)]
+        self.assertEqual(self.claimed_ids(limit=1), [first.id])
+        self.assertEqual(self.claimed_ids(), [second.id])
+        self.assertEqual(self.claimed_ids(), [])
+
+    def test_claim_skips_jobs_claimed_after_they_were_listed(self):
+        job = Job.objects.enqueue('failing')
+        update = type(Job.objects.all()).update
+
+        def claimed_by_another_worker(queryset, **kwargs):
+            update(Job.objects.filter(pk=job.pk), status=Job.STATUS_RUNNING, locked_at=self.now)
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(type(Job.objects.all()), 'update', autospec=True,
+                               side_effect=claimed_by_another_worker):
+            self.assertEqual(self.claimed_ids(), [])
+
+    def test_failures_back_off_exponentially(self):
+        job = Job.objects.enqueue('failing')
+        for attempt, delay in enumerate([10, 20, 40, 80], start=1):
+            self.assertFalse(jobs.run_job(job))
+            job.refresh_from_db()
+            self.assertEqual(job.status, Job.STATUS_PENDING)
+            self.assertEqual(job.attempts, attempt)
+            self.assertEqual(job.run_at, self.now + timedelta(seconds=delay))
+            self.assertIn('boom', job.last_error)
+        self.assertEqual(self.claimed_ids(), [])
+
+    def test_job_fails_after_max_attempts(self):
+        job = Job.objects.enqueue('failing')
+        for _ in range(jobs.MAX_ATTEMPTS):
+            job.run_at = self.now
+            job.save()
+            self.assertEqual(self.claimed_ids(), [job.id])
+            jobs.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertEqual(self.failing.call_count, jobs.MAX_ATTEMPTS)
+        job.run_at = self.now
+        job.save()
+        self.assertEqual(self.claimed_ids(), [])
+
+    def test_expired_lease_is_reclaimed(self):
+        running = Job.objects.create(
+            name='failing', status=Job.STATUS_RUNNING, locked_at=self.now - jobs.LEASE / 2)
+        abandoned = Job.objects.create(
+            name='failing', status=Job.STATUS_RUNNING,
+            locked_at=self.now - jobs.LEASE - timedelta(seconds=1))
+        self.assertEqual(self.claimed_ids(), [abandoned.id])
+        running.refresh_from_db()
+        self.assertEqual(running.locked_at, self.now - jobs.LEASE / 2)
+
+
+class RunJobsCommandTests(TransactionTestCase):
+    """
+    run_jobs workers use their own connections, so the jobs have to be
+    committed for them to see.
+    """
+
+    def test_runs_queued_order_events(self):
+        customer = User.objects.create_user('buyer', 'buyer@example.com', 'secret').customer
+        order = Order.objects.create(customer=customer)
+        job = Job.objects.enqueue('order_created', order_id=order.id)
+        failing = Job.objects.enqueue('order_created', order_id=order.id + 1)
+        receiver = mock.Mock()
+        order_created.connect(receiver, weak=False)
+        self.addCleanup(order_created.disconnect, receiver)
+
+        stdout = io.StringIO()
+        with mock.patch('sys.stdout', stdout):
+            call_command('run_jobs', '--once', '--workers', '2')
+
+        self.assertEqual(receiver.call_args.kwargs['order'], order)
+        job.refresh_from_db()
+        failing.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertEqual((failing.status, failing.attempts), (Job.STATUS_PENDING, 1))
+        self.assertIn('Jobs completed: 1, attempts failed: 1', stdout.getvalue())
+
+
+class ResponseCacheTests:
+    """
+    Anonymous product responses are served from the cache until a catalog
+    write commits. Run against each cache backend by the subclasses below.
+    """
+
+    def get_cache_settings(self):
+        raise NotImplementedError
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title='Collection')
+        cls.product = Product.objects.create(
+            title='Coffee', slug='coffee', unit_price=10, inventory=5, collection=cls.collection)
+
+    def setUp(self):
+        self.enterContext(override_settings(CACHES={'default': self.get_cache_settings()}))
+        caches['default'].clear()
+        cache._local_versions.clear()
+        product_cache.local.clear()
+        self.client = APIClient()
+
+    def list_url(self):
+        return '/store/products/?expand=collection'
+
+    def detail_url(self):
+        return f'/store/products/{self.product.id}/?expand=collection'
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'][0] if 'results' in response.data else response.data
+
+    def assert_serves(self, **values):
+        for url in [self.list_url(), self.detail_url()]:
+            data = self.get(url)
+            self.assertEqual({name: data[name] for name in values}, values, url)
+
+    def write_behind_the_orm(self, title):
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {Product._meta.db_table} SET title = %s WHERE id = %s',
+                           [title, self.product.id])
+
+    def test_anonymous_responses_are_cached(self):
+        self.assert_serves(title='Coffee')
+        self.write_behind_the_orm('Tea')
+        self.assert_serves(title='Coffee')
+
+    def test_authenticated_responses_are_not_cached(self):
+        user = User.objects.create_user('reader', 'reader@example.com', 'secret')
+        token = TokenObtainPairSerializer.get_token(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+        self.assert_serves(title='Coffee')
+        self.write_behind_the_orm('Tea')
+        self.assert_serves(title='Tea')
+
+    def test_product_write_invalidates(self):
+        self.assert_serves(title='Coffee')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'Tea'
+            self.product.save()
+        self.assert_serves(title='Tea')
+
+    def test_product_image_write_invalidates(self):
+        self.assert_serves(images=[])
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image='store/images/coffee.jpg')
+        self.assertEqual([item['id'] for item in self.get(self.detail_url())['images']], [image.id])
+        self.assertEqual([item['id'] for item in self.get(self.list_url())['images']], [image.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assert_serves(images=[])
+
+    def test_collection_write_invalidates(self):
+        self.assertEqual(self.get(self.detail_url())['collection']['title'], 'Collection')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.collection.title = 'Drinks'
+            self.collection.save()
+        for url in [self.list_url(), self.detail_url()]:
+            self.assertEqual(self.get(url)['collection']['title'], 'Drinks')
+
+
+class LocMemResponseCacheTests(ResponseCacheTests, TestCase):
+    def get_cache_settings(self):
+        return {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'response-cache-tests',
+        }
+
+
+class FileBasedResponseCacheTests(ResponseCacheTests, TestCase):
+    def get_cache_settings(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        return {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location,
+        }
+
+
+class StaleWhileRevalidateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title='Collection')
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+
+    def titles(self):
+        response = self.client.get('/store/collections/')
+        self.assertEqual(response.status_code, 200)
+        return [collection['title'] for collection in response.data]
+
+    def write_behind_the_orm(self, title):
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {Collection._meta.db_table} SET title = %s WHERE id = %s',
+                           [title, self.collection.id])
+
+    def test_fresh_hit_is_served_without_queries(self):
+        self.assertEqual(self.titles(), ['Collection'])
+        self.write_behind_the_orm('Drinks')
+        with mock.patch('store.cache.threading.Thread') as thread, self.assertNumQueries(0):
+            self.assertEqual(self.titles(), ['Collection'])
+        thread.assert_not_called()
+
+    def test_stale_hit_is_served_while_a_refresh_starts(self):
+        with mock.patch.object(CollectionViewSet, 'cache_soft_timeout', 0):
+            self.assertEqual(self.titles(), ['Collection'])
+        self.write_behind_the_orm('Drinks')
+
+        with mock.patch('store.cache.threading.Thread') as thread, self.assertNumQueries(0):
+            self.assertEqual(self.titles(), ['Collection'])
+        thread.return_value.start.assert_called_once_with()
+
+        # Run the refresh here: the test's transaction lives on this
+        # thread's connection, which it must not close.
+        with mock.patch('store.cache.connections.close_all'):
+            thread.call_args.kwargs['target'](*thread.call_args.kwargs['args'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(), ['Drinks'])
+
+    def test_collection_write_drops_entries_at_once(self):
+        self.assertEqual(self.titles(), ['Collection'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.collection.title = 'Drinks'
+            self.collection.save()
+        with mock.patch('store.cache.threading.Thread') as thread:
+            self.assertEqual(self.titles(), ['Drinks'])
+        thread.assert_not_called()
+
+    def test_products_count_change_drops_entries_at_once(self):
+        response = self.client.get(f'/store/collections/{self.collection.id}/')
+        self.assertEqual(response.data['products_count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                title='Coffee', slug='coffee', unit_price=10, inventory=5, collection=self.collection)
+        response = self.client.get(f'/store/collections/{self.collection.id}/')
+        self.assertEqual(response.data['products_count'], 1)
+
+
+class ReplicaTestCase(TestCase):
+    """
+    Adds a second SQLite file as the `replica` alias. Nothing replicates to
+    it, so it stands in for a replica that has not caught up yet;
+    `replicate()` copies rows over by hand.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_directory = tempfile.mkdtemp()
+        connections.settings['replica'] = {
+            **connections.settings['default'],
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(cls.replica_directory, 'replica.sqlite3'),
+            'OPTIONS': {},
+        }
+        call_command('migrate', database='replica', verbosity=0)
+        # Declared here rather than on the class: the test runner checks and
+        # creates every database a class names before the alias exists.
+        cls.databases = {'default', 'replica'}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        shutil.rmtree(cls.replica_directory)
+
+    def replicate(self, *objs):
+        # The base manager skips the signals and counters of the primary.
+        for obj in objs:
+            type(obj)._base_manager.using('replica').bulk_create([obj])
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaTests(ReplicaTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        user_cache.clear()
+        search._backend = None
+        self.client = APIClient()
+
+    def authenticate(self, user):
+        token = TokenObtainPairSerializer.get_token(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+
+    def create_product(self):
+        collection = Collection.objects.create(title='Collection')
+        product = Product.objects.create(
+            title='Coffee', slug='coffee', unit_price=10, inventory=5, collection=collection)
+        self.replicate(collection, product)
+        return product
+
+    def reviews(self, client, product):
+        return [review['name'] for review in client.get(f'/store/products/{product.id}/reviews/').data]
+
+    def post_review(self, client, product):
+        return client.post(f'/store/products/{product.id}/reviews/',
+                           {'name': 'Reviewer', 'description': 'Good'}, format='json')
+
+    def test_router_sends_reads_to_the_replica_only_when_allowed(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Product), 'default')
+        token = _use_replica.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            self.assertEqual(router.db_for_write(Product), 'default')
+        finally:
+            _use_replica.reset(token)
+
+    def test_reads_go_to_the_replica(self):
+        product = self.create_product()
+        review = Review.objects.create(product=product, name='Reviewer', description='Good')
+        self.assertEqual(self.reviews(self.client, product), [])
+        self.replicate(review)
+        self.assertEqual(self.reviews(self.client, product), ['Reviewer'])
+
+    def test_viewsets_without_read_from_replica_read_the_primary(self):
+        cart = Cart.objects.create()
+        self.assertEqual(self.client.get(f'/store/carts/{cart.id}/').status_code, 200)
+
+    def test_writes_go_to_the_primary(self):
+        product = self.create_product()
+        response = self.post_review(self.client, product)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Review.objects.using('default').filter(pk=response.data['id']).exists())
+        self.assertFalse(Review.objects.using('replica').exists())
+
+    def test_writer_is_pinned_to_the_primary_by_cookie(self):
+        product = self.create_product()
+        response = self.post_review(self.client, product)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.reviews(self.client, product), ['Reviewer'])
+        self.assertEqual(self.reviews(APIClient(), product), [])
+
+    def test_writer_is_pinned_to_the_primary_by_token(self):
+        product = self.create_product()
+        writer = User.objects.create_user('writer', 'writer@example.com', 'secret')
+        reader = User.objects.create_user('reader', 'reader@example.com', 'secret')
+        self.authenticate(writer)
+        self.post_review(self.client, product)
+
+        # Token clients often drop cookies.
+        writer_client = APIClient()
+        writer_client.credentials(**self.client._credentials)
+        self.assertEqual(self.reviews(writer_client, product), ['Reviewer'])
+        reader_client = APIClient()
+        self.client = reader_client
+        self.authenticate(reader)
+        self.assertEqual(self.reviews(reader_client, product), [])
+
+    def test_authenticates_users_the_replica_does_not_have_yet(self):
+        self.authenticate(User.objects.create_user('new', 'new@example.com', 'secret'))
+        response = self.client.get('/store/products/?search=coffee')
+        self.assertEqual(response.status_code, 200)
+
+    def test_rejects_users_deactivated_since_the_replica_copy(self):
+        user = User.objects.create_user('old', 'old@example.com', 'secret')
+        self.replicate(user)
+        self.authenticate(user)
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        response = self.client.get('/store/products/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_search_index_is_built_from_the_primary(self):
+        collection = Collection.objects.create(title='Collection')
+        product = Product.objects.create(
+            title='Coffee', slug='coffee', unit_price=10, inventory=5, collection=collection)
+        self.authenticate(User.objects.create_user('reader', 'reader@example.com', 'secret'))
+        self.assertEqual(self.client.get('/store/products/?search=coffee').data['results'], [])
+        self.replicate(collection, product)
+        response = self.client.get('/store/products/?search=coffee')
+        self.assertEqual([item['id'] for item in response.data['results']], [product.id])
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        cls.product = Product.objects.create(
+            title='Coffee', slug='coffee', unit_price=10, inventory=5, collection=collection)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+
+    def test_unchanged_list_answers_304_to_its_etag(self):
+        etag = self.client.get('/store/products/')['ETag']
+        self.assertEqual(self.client.get('/store/products/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'Tea'
+            self.product.save()
+        self.assertEqual(self.client.get('/store/products/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_no_last_modified_within_a_second_of_a_change(self):
+        response = self.client.get('/store/products/')
+        self.assertNotIn('Last-Modified', response)
+        since = http_date(time.time())
+        self.assertEqual(self.client.get('/store/products/', HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+
+    def test_last_modified_once_the_newest_change_is_a_second_old(self):
+        self.client.get('/store/products/')
+        with mock.patch('store.cache.time.time', return_value=time.time() + 5):
+            response = self.client.get('/store/products/')
+            last_modified = response['Last-Modified']
+            response = self.client.get('/store/products/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
@@ -1,29 +1,96 @@
 from store.permissions import FullDjangoModelPermissions, IsAdminOrReadOnly, ViewCustomerHistoryPermission
-from store.pagination import DefaultPagination
-from django.db.models.aggregates import Count
+from store.cache import CachedObjectMixin, CachedResponseMixin, ConditionalGetMixin, StaleWhileRevalidateMixin, customer_cache, product_cache
+from store.pagination import KeysetPagination, OrderHistoryPagination
+from django.db.models import DecimalField, F, Prefetch, Sum, Value
+from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action, permission_classes
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.exceptions import ValidationError
 from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, RetrieveModelMixin, UpdateModelMixin
 from rest_framework.permissions import AllowAny, DjangoModelPermissions, DjangoModelPermissionsOrAnonReadOnly, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework import status
-from .filters import ProductFilter
+from .filters import ProductFilter, ProductSearchFilter, RelevanceOrderingFilter
+from .mixins import ValuesListMixin
 from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, Review, ProductImage
-from .serializers import AddCartItemSerializer, CartItemSerializer, CartSerializer, CollectionSerializer, CreateOrderSerializer, CustomerSerializer, OrderSerializer, ProductSerializer, ReviewSerializer, UpdateCartItemSerializer, UpdateOrderSerializer, ProductImageSerializer
+from .serializers import AddCartItemSerializer, CartItemSerializer, CartSerializer, CollectionSerializer, CreateOrderSerializer, CustomerSerializer, OrderSerializer, ProductSerializer, ProductValuesSerializer, ReviewSerializer, UpdateCartItemSerializer, UpdateOrderSerializer, ProductImageSerializer
 
 
-class ProductViewSet(ModelViewSet):
-    queryset = Product.objects.prefetch_related('images').all()
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, CachedObjectMixin, ValuesListMixin, ModelViewSet):
+    queryset = Product.objects.all()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    values_serializer_class = ProductValuesSerializer
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, RelevanceOrderingFilter]
     filterset_class = ProductFilter
-    pagination_class = DefaultPagination
+    pagination_class = KeysetPagination
+    object_cache = product_cache
     permission_classes = [IsAdminOrReadOnly]
     search_fields = ['title', 'description']
     ordering_fields = ['unit_price', 'last_update']
+    ordering = ['title']
+    # The ETag's MAX, the rows and their images; ?collection_id= adds the
+    # filter's collection lookup, ?expand=promotions a prefetch, and a user
+    # missing from user_cache its row.
+    query_budget = {'list': 6, 'retrieve': 5}
+    read_from_replica = True
+
+    # Columns a sparse fieldset always loads: the pk and anything the
+    # keyset pagination may order by.
+    sparse_columns = {'id', 'title', 'unit_price', 'last_update'}
+    # Serializer fields that read a different column, or none.
+    sparse_sources = {'price_with_tax': 'unit_price', 'images': None, 'promotions': None}
+
+    def get_list_param(self, name, allowed):
+        value = self.request.query_params.get(name)
+        if not value or self.request.method not in ('GET', 'HEAD'):
+            return None
+        names = [item.strip() for item in value.split(',') if item.strip()]
+        unknown = set(names) - set(allowed)
+        if unknown:
+            raise ValidationError({name: [f'Unknown field(s): {", ".join(sorted(unknown))}.']})
+        return names
+
+    def get_requested_fields(self):
+        """
+        Parses `?fields=id,title,...` on reads; None means every field.
+        """
+        return self.get_list_param('fields', ProductSerializer.Meta.fields)
+
+    def get_requested_expansions(self):
+        """
+        Parses `?expand=collection,promotions,...` on reads.
+        """
+        return self.get_list_param('expand', ProductSerializer.Meta.expandable_fields) or []
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        expand = self.get_requested_expansions()
+
+        relations = {'images'} if fields is None or 'images' in fields else set()
+        select, prefetch = ProductSerializer.get_prefetch_plan(sorted(relations.union(expand)))
+        queryset = queryset.select_related(*select).prefetch_related(*prefetch)
+        if fields is None:
+            return queryset
+
+        columns = {self.sparse_sources.get(name, name) for name in fields + expand}
+        columns.discard(None)
+        return queryset.only(*columns | self.sparse_columns)
+
+    def use_values_serializer(self):
+        # Nested expansions need the regular serializer.
+        return super().use_values_serializer() and not self.get_requested_expansions()
+
+    def get_values_serializer(self):
+        return self.values_serializer_class(
+            fields=self.get_requested_fields(), context=self.get_serializer_context())
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_requested_fields())
+        kwargs.setdefault('expand', self.get_requested_expansions())
+        return super().get_serializer(*args, **kwargs)
 
     def get_serializer_context(self):
         return {'request': self.request}
@@ -35,11 +102,12 @@ class ProductViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.annotate(
-        products_count=Count('products')).all()
+class CollectionViewSet(StaleWhileRevalidateMixin, ModelViewSet):
+    queryset = Collection.objects.all()
     serializer_class = CollectionSerializer
     permission_classes = [IsAdminOrReadOnly]
+    query_budget = {'list': 1, 'retrieve': 1}
+    read_from_replica = True
 
     def destroy(self, request, *args, **kwargs):
         if Product.objects.filter(collection_id=kwargs['pk']):
@@ -50,6 +118,8 @@ class CollectionViewSet(ModelViewSet):
 
 class ReviewViewSet(ModelViewSet):
     serializer_class = ReviewSerializer
+    query_budget = {'list': 1, 'retrieve': 1}
+    read_from_replica = True
 
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs['product_pk'])
@@ -62,12 +132,21 @@ class CartViewSet(CreateModelMixin,
                   RetrieveModelMixin,
                   DestroyModelMixin,
                   GenericViewSet):
-    queryset = Cart.objects.prefetch_related('items__product').all()
+    queryset = Cart.objects \
+        .prefetch_related(Prefetch(
+            'items',
+            queryset=CartItem.objects.with_total_price().select_related('product'))) \
+        .annotate(total_price=Coalesce(
+            Sum(F('items__quantity') * F('items__product__unit_price')),
+            Value(0),
+            output_field=DecimalField(max_digits=12, decimal_places=2)))
     serializer_class = CartSerializer
+    query_budget = {'retrieve': 2}
 
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
+    query_budget = {'list': 1, 'retrieve': 1, 'create': 1}
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -81,6 +160,7 @@ class CartItemViewSet(ModelViewSet):
 
     def get_queryset(self):
         return CartItem.objects \
+            .with_total_price() \
             .filter(cart_id=self.kwargs['cart_pk']) \
             .select_related('product')
 
@@ -89,6 +169,7 @@ class CustomerViewSet(ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [IsAdminUser]
+    query_budget = {'list': 2, 'retrieve': 2, 'me': 2}
 
     @action(detail=True, permission_classes=[ViewCustomerHistoryPermission])
     def history(self, request, pk):
@@ -96,12 +177,14 @@ class CustomerViewSet(ModelViewSet):
 
     @action(detail=False, methods=['GET', 'PUT'], permission_classes=[IsAuthenticated])
     def me(self, request):
-        customer = Customer.objects.get(
-            user_id=request.user.id)
+        customer_id = request.user.customer_id
         if request.method == 'GET':
+            customer = customer_cache.get_or_set(
+                customer_id, lambda: Customer.objects.get(pk=customer_id))
             serializer = CustomerSerializer(customer)
             return Response(serializer.data)
         elif request.method == 'PUT':
+            customer = Customer.objects.get(pk=customer_id)
             serializer = CustomerSerializer(customer, data=request.data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
@@ -110,6 +193,8 @@ class CustomerViewSet(ModelViewSet):
 
 class OrderViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+    pagination_class = OrderHistoryPagination
+    query_budget = {'list': 3, 'retrieve': 3}
 
     def get_permissions(self):
         if self.request.method in ['PATCH', 'DELETE']:
@@ -119,7 +204,7 @@ class OrderViewSet(ModelViewSet):
     def create(self, request, *args, **kwargs):
         serializer = CreateOrderSerializer(
             data=request.data,
-            context={'user_id': self.request.user.id})
+            context={'customer_id': self.request.user.customer_id})
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
         serializer = OrderSerializer(order)
@@ -134,16 +219,17 @@ class OrderViewSet(ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        queryset = Order.objects.prefetch_related(Prefetch(
+            'items', queryset=OrderItem.objects.select_related('product')))
 
         if user.is_staff:
-            return Order.objects.all()
+            return queryset
 
-        customer_id = Customer.objects.only(
-            'id').get(user_id=user.id)
-        return Order.objects.filter(customer_id=customer_id)
+        return queryset.filter(customer_id=user.customer_id)
 
 class ProductImageViewSet(ModelViewSet):
     serializer_class = ProductImageSerializer
+    query_budget = {'list': 1, 'retrieve': 1}
     
     def get_serializer_context(self):
         return {'product_id': self.kwargs['product_pk']}
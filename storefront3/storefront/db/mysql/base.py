@@ -0,0 +1,11 @@
+from django.db.backends.mysql import base
+from ..pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def check_connection(self, connection):
+        try:
+            connection.ping()
+        except base.Database.Error:
+            return False
+        return True
@@ -0,0 +1,228 @@
+import os
+import threading
+import time
+from collections import deque
+from django.db.utils import OperationalError
+
+
+class ConnectionPool:
+    """
+    A process-wide pool of raw DB-API connections for one database alias.
+    Thread-safe; under ASGI Django runs ORM code in worker threads, so the
+    blocking wait in acquire() never stalls the event loop.
+    """
+
+    def __init__(self, alias, min_size=1, max_size=10, timeout=30, max_lifetime=1800):
+        self.alias = alias
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._filled = False
+        self._condition = threading.Condition()
+        self.created = 0
+        self.closed = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.failed_checks = 0
+
+    def _expired(self, created_at):
+        return self.max_lifetime is not None and time.monotonic() - created_at > self.max_lifetime
+
+    def _reserve(self):
+        """
+        Takes an idle connection, or a slot to open a new one (None),
+        waiting up to `timeout` when the pool is exhausted.
+        """
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        with self._condition:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise OperationalError(
+                        f"Connection pool '{self.alias}' exhausted: "
+                        f'{self.max_size} connections in use for {self.timeout}s.')
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                started = time.monotonic()
+                self._condition.wait(remaining)
+                self.wait_seconds += time.monotonic() - started
+
+    def _open(self, create):
+        try:
+            connection = create()
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self.created += 1
+        return connection, time.monotonic()
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self._condition:
+            self._size -= 1
+            self.closed += 1
+            self._condition.notify()
+
+    def _fill(self, create):
+        # Opens min_size connections up front so the first requests of a
+        # fresh worker don't all pay the handshake.
+        self._filled = True
+        for _ in range(self.min_size - 1):
+            with self._condition:
+                if self._size >= self.max_size:
+                    return
+                self._size += 1
+            entry = self._open(create)
+            with self._condition:
+                self._idle.appendleft(entry)
+
+    def acquire(self, create, check):
+        """
+        Checks out a connection, reusing an idle one when it is younger than
+        max_lifetime and passes `check`, otherwise opening one with `create`.
+        """
+        if not self._filled:
+            self._fill(create)
+        while True:
+            entry = self._reserve()
+            if entry is None:
+                connection, created_at = self._open(create)
+            else:
+                connection, created_at = entry
+                if self._expired(created_at):
+                    self._discard(connection)
+                    continue
+                if not check(connection):
+                    with self._condition:
+                        self.failed_checks += 1
+                    self._discard(connection)
+                    continue
+            with self._condition:
+                self._in_use[id(connection)] = created_at
+                self.checkouts += 1
+            return connection
+
+    def release(self, connection, discard=False):
+        with self._condition:
+            created_at = self._in_use.pop(id(connection), None)
+        if created_at is None:
+            # Not ours, e.g. checked out before a fork reset the pool.
+            connection.close()
+            return
+        if not discard:
+            try:
+                connection.rollback()
+            except Exception:
+                discard = True
+        if discard or self._expired(created_at):
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, created_at))
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'pid': os.getpid(),
+                'size': self._size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'created': self.created,
+                'closed': self.closed,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'timeouts': self.timeouts,
+                'failed_checks': self.failed_checks,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    """
+    Returns the pool for an alias and the database it currently points at.
+    Test runs rename the database of an alias, so the alias alone must never
+    hand back connections to the database it used to name.
+    """
+    key = (alias, *(settings_dict.get(name) for name in ('NAME', 'HOST', 'PORT', 'USER')))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            options = {key.lower(): value for key, value in settings_dict.get('POOL', {}).items()}
+            pool = _pools[key] = ConnectionPool(alias, **options)
+            pool.database = settings_dict.get('NAME')
+        return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        return {f'{pool.alias}:{pool.database}': pool.stats() for pool in _pools.values()}
+
+
+# A forked child must not reuse its parent's sockets; dropping the pools
+# (without closing the connections, which would end the parent's sessions)
+# makes it open its own.
+os.register_at_fork(after_in_child=_pools.clear)
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Makes a Django DatabaseWrapper check connections out of a ConnectionPool
+    instead of opening them, and hand them back instead of closing them.
+    Configure with a POOL dict in the database settings (MIN_SIZE, MAX_SIZE,
+    TIMEOUT, MAX_LIFETIME) and leave CONN_MAX_AGE at 0 so connections go
+    back to the pool at the end of every request.
+    """
+
+    def get_pool(self):
+        return get_pool(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        create = super().get_new_connection
+        # Remembered so the connection goes back to the pool it came from
+        # even if settings_dict changes while it is open.
+        self._pool = self.get_pool()
+        return self._pool.acquire(lambda: create(conn_params), self.check_connection)
+
+    def check_connection(self, connection):
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def _close(self):
+        if self.connection is not None:
+            # A connection closed mid-transaction stays referenced by this
+            # wrapper until the atomic block exits, so it can't be shared.
+            self._pool.release(self.connection, discard=self.in_atomic_block)
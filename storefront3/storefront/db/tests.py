@@ -0,0 +1,136 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+from django.db import connections
+from django.db.utils import OperationalError
+from django.test import SimpleTestCase
+from storefront.db.pool import ConnectionPool
+from storefront.db.sqlite3.base import DatabaseWrapper
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        pass
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.opened = []
+
+    def make_pool(self, **options):
+        return ConnectionPool('pool_test', **{'min_size': 1, 'max_size': 2, 'timeout': 5, **options})
+
+    def create(self):
+        connection = FakeConnection()
+        self.opened.append(connection)
+        return connection
+
+    def acquire(self, pool, check=lambda connection: True):
+        return pool.acquire(self.create, check)
+
+    def test_exhausted_pool_blocks_until_a_connection_is_released(self):
+        pool = self.make_pool(max_size=1)
+        connection = self.acquire(pool)
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(self.acquire(pool)))
+        waiter.start()
+        # Wait until the waiter is actually blocked on the pool.
+        while not pool.stats()['waits']:
+            time.sleep(0.001)
+        self.assertEqual(acquired, [])
+        pool.release(connection)
+        waiter.join(5)
+        self.assertEqual(acquired, [connection])
+        self.assertEqual(pool.stats()['created'], 1)
+
+    def test_exhausted_pool_raises_after_timeout(self):
+        pool = self.make_pool(max_size=1, timeout=0.05)
+        self.acquire(pool)
+        with self.assertRaisesMessage(OperationalError, "Connection pool 'pool_test' exhausted"):
+            self.acquire(pool)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_connections_past_max_lifetime_are_discarded(self):
+        self.now = 1000.0
+        with mock.patch('storefront.db.pool.time.monotonic', side_effect=lambda: self.now):
+            pool = self.make_pool(max_lifetime=60)
+            old = self.acquire(pool)
+            pool.release(old)
+            self.now += 61
+            new = self.acquire(pool)
+            self.assertIsNot(new, old)
+            self.assertTrue(old.closed)
+
+            # Expiring while checked out: dropped on release.
+            self.now += 61
+            pool.release(new)
+            self.assertTrue(new.closed)
+        self.assertEqual(pool.stats()['idle'], 0)
+        self.assertEqual(pool.stats()['closed'], 2)
+
+    def test_connections_failing_the_health_check_are_discarded(self):
+        pool = self.make_pool()
+        broken = self.acquire(pool)
+        pool.release(broken)
+        connection = self.acquire(pool, check=lambda connection: connection is not broken)
+        self.assertIsNot(connection, broken)
+        self.assertTrue(broken.closed)
+        stats = pool.stats()
+        self.assertEqual((stats['failed_checks'], stats['closed'], stats['size']), (1, 1, 1))
+
+
+class PooledConnectionTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.first = os.path.join(directory.name, 'first.sqlite3')
+        self.second = os.path.join(directory.name, 'second.sqlite3')
+
+    def make_wrapper(self, name):
+        settings_dict = connections.create_connection('default').settings_dict.copy()
+        settings_dict.update(ENGINE='storefront.db.sqlite3', NAME=name, POOL={'MAX_SIZE': 2})
+        wrapper = DatabaseWrapper(settings_dict, alias='pool_test')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def database_file(self, wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA database_list')
+            return cursor.fetchone()[2]
+
+    def test_switching_name_opens_a_connection_to_the_new_database(self):
+        # What create_test_db() does: close, then point the alias elsewhere.
+        wrapper = self.make_wrapper(self.first)
+        self.assertEqual(self.database_file(wrapper), self.first)
+        wrapper.close()
+        wrapper.settings_dict['NAME'] = self.second
+        self.assertEqual(self.database_file(wrapper), self.second)
+
+    def test_connection_returns_to_the_pool_it_came_from(self):
+        wrapper = self.make_wrapper(self.first)
+        self.database_file(wrapper)
+        pool = wrapper.get_pool()
+        wrapper.settings_dict['NAME'] = self.second
+        wrapper.close()
+        self.assertEqual(pool.stats()['idle'], 1)
+        self.assertEqual(wrapper.get_pool().stats()['size'], 0)
+
+    def test_dead_idle_connection_is_discarded(self):
+        wrapper = self.make_wrapper(self.first)
+        self.database_file(wrapper)
+        dead = wrapper.connection
+        wrapper.close()
+        dead.close()
+        self.assertEqual(self.database_file(wrapper), self.first)
+        self.assertIsNot(wrapper.connection, dead)
+        stats = wrapper.get_pool().stats()
+        self.assertEqual((stats['failed_checks'], stats['closed'], stats['size']), (1, 1, 1))